@@ -8,6 +8,9 @@ Arduino library.
 
 from . pixels import Pixels
 from . matrix import Matrix, make_matrix_coord_map
+from . sprites import SpriteSheet
+from . layers import Layers, BLEND
+from . display_list import DisplayList
 
 
 __pdoc__ = {}
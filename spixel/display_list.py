@@ -0,0 +1,116 @@
+"""
+Retained display lists, to draw static overlays without rasterizing them every frame.
+"""
+
+from . drivers.driver_base import DriverBase
+from . matrix import Matrix
+from . layers import _lit_mask
+from . sprites import _runs
+
+# extra Matrix methods that can be recorded besides draw_*
+RECORDABLE = ('set', 'blit')
+
+_INVERT = bytes(range(255, -1, -1))
+
+
+def _copy_args(value):
+    """Copy the lists, tuples, dicts and bytearrays in recorded arguments,
+    other objects are kept by reference"""
+    if isinstance(value, (list, tuple)):
+        return type(value)([_copy_args(v) for v in value])
+    if isinstance(value, dict):
+        return {k: _copy_args(v) for k, v in value.items()}
+    if isinstance(value, bytearray):
+        return bytes(value)
+    return value
+
+
+class DisplayList(object):
+    """Records `spixel.matrix.Matrix` drawing calls once and replays the pixels they produce.
+
+    Call any `draw_*` method, `set` or `blit` on the display list to record
+    it. `DisplayList.replay` draws the recorded calls onto the matrix. The
+    first replay rasterizes them onto scratch buffers to find every pixel
+    they touch. Later replays copy those pixels into the buffer as runs of
+    slices. Recording, removing or changing calls, or recompiling the
+    matrix coordinate map, rebuilds the cache on the next replay.
+
+        overlay = DisplayList(matrix)
+        overlay.draw_rect(0, 0, matrix.width, matrix.height, colors.Blue)
+        overlay.draw_text('SCORE', 2, 1, colors.White, None)
+        while True:
+            draw_background(matrix)
+            overlay.replay()
+            matrix.update()
+
+    Calls that blend with the pixels below them, such as `aa=True` or
+    `blit` with `alpha`, are cached as drawn over black. Arguments other
+    than lists, tuples, dicts and bytes, such as a `Matrix` passed to `blit`,
+    are compared by identity, so changing their contents doesn't invalidate
+    the cache.
+
+    `matrix`: `spixel.matrix.Matrix` to draw onto
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.commands = []
+        """Recorded `(name, args, kwds)` tuples, may be edited directly"""
+        self._key = None
+        self._runs = []
+
+    def __getattr__(self, name):
+        if (name.startswith('draw_') or name in RECORDABLE) and hasattr(Matrix, name):
+            return lambda *args, **kwds: self.record(name, *args, **kwds)
+        raise AttributeError(name)
+
+    def record(self, name, *args, **kwds):
+        """Record a call to the `Matrix` method `name`. Arguments are copied,
+        so changing them afterwards doesn't affect the list."""
+        self.commands.append((name, _copy_args(args), _copy_args(kwds)))
+
+    def clear(self):
+        """Remove all recorded calls"""
+        del self.commands[:]
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _render(self, background):
+        m = self.matrix
+        scratch = Matrix(DriverBase(), m.width, m.height, coord_map=m.map)
+        scratch.buffer = [background] * len(scratch.buffer)
+        for name, args, kwds in self.commands:
+            getattr(scratch, name)(*args, **kwds)
+        return bytes(scratch.buffer)
+
+    def compile(self):
+        """Rasterize the recorded calls and cache the pixels they touch.
+        Called by `DisplayList.replay` when needed."""
+        # deep copy, so arguments changed in place also invalidate the cache
+        self._key = (self.matrix.offsets, _copy_args(self.commands))
+        self._runs = []
+        if not self.commands:
+            return
+
+        # a pixel is touched if it changed on a black or a white background
+        on_black = self._render(0)
+        on_white = self._render(255)
+        lit = _lit_mask(on_black)
+        touched = lit | _lit_mask(on_white.translate(_INVERT))
+        colors = (int.from_bytes(on_black, 'big') & lit) | (int.from_bytes(on_white, 'big') & ~lit)
+        colors = colors.to_bytes(len(on_black), 'big')
+
+        # one byte per buffer pixel, 0 where touched
+        untouched = touched.to_bytes(len(on_black), 'big')[0::3].translate(bytes([1] + [0] * 255))
+        self._runs = [(a * 3, b * 3, colors[a * 3:b * 3]) for a, b in _runs(untouched)]
+
+    def replay(self):
+        """Draw the recorded calls onto the matrix from the cache"""
+        key = self._key
+        if (key is None or key[0] is not self.matrix.offsets or
+                key[1] != self.commands):
+            self.compile()
+        buf = self.matrix.buffer
+        for start, stop, data in self._runs:
+            buf[start:stop] = data
@@ -1,81 +1,60 @@
-from . driver_base import DriverBase, ChannelOrder
-from .. import log
-# import spidev
-
-
-class APA102(DriverBase):
-    """Base driver for controling SPI devices on systems like the Raspberry Pi and BeagleBone"""
-
-    def __init__(self, pixels, c_order=ChannelOrder.BGR, dev="/dev/spidev0.0", SPISpeed=12):
-
-        super().__init__(pixels, c_order=c_order)
-
-        self.dev = dev
-        self._spiSpeed = SPISpeed
-
-        a, b = -1, -1
-        d = self.dev.replace("/dev/spidev", "")
-        s = d.split('.')
-        if len(s) == 2:
-            a = int(s[0])
-            b = int(s[1])
-
-        if a < 0 or b < 0:
-            error = "When using py-spidev, the given device must be in the format /dev/spidev*.*"
-            log.error(error)
-            raise ValueError(error)
-
-        self._bootstrapSPIDev()
-        import spidev
-        self.spi = spidev.SpiDev()
-        self.spi.open(a, b)
-        self.spi.max_speed_hz = int(self._spiSpeed * 1000000.0)
-        log.info('py-spidev speed @ %.1f MHz',
-                    (float(self.spi.max_speed_hz) / 1000000.0))
-
-        # self.gamma = [int(pow(float(i) / 255.0, 2.5) * 255.0 + 0.5) for i in range(256)]
-        self.gamma = [int(pow(float(i) / 255.0, 1.0 / 0.45) * 255.0) for i in range(256)]
-
-        # APA102/SK9822 requires latch bytes at the end)
-        # Many thanks to this article for combined APA102/SK9822 protocol
-        # https://cpldcpu.com/2016/12/13/sk9822-a-clone-of-the-apa102/
-        self._start_frame = 4  # start frame is [0, 0, 0, 0]
-        self._pixel_bytes = self.num * 4  # 4 byte frames [bright, r, g, b]
-        self._pixel_stop = self._start_frame + self._pixel_bytes
-        self._reset_frame = 4  # for SK9822 [0, 0, 0, 0]
-        self._end_frame = (self.num // 2) + 1
-        self._packet_size = (self._start_frame + self._pixel_bytes +  self._reset_frame + self._end_frame)
-        self._packet = [0] * self._packet_size
-
-        self.set_device_brightness(0xFF)  # required to setup _packet
-
-    def _bootstrapSPIDev(self):
-        import os.path
-        try:
-            import spidev
-        except:
-            error = "Unable to import spidev. Please install. pip install spidev"
-            log.error(error)
-            raise ImportError(error)
-
-        if not os.path.exists(self.dev):
-            error = "Cannot find SPI device. Please see https://github.com/maniacallabs/bibliopixel/wiki/SPI-Setup for details."
-            log.error(error)
-            raise IOError(error)
-
-        # permissions check
-        try:
-            open(self.dev)
-        except IOError as e:
-            if e.errno == 13:
-                error = "Cannot find SPI device. Please see https://github.com/maniacallabs/bibliopixel/wiki/SPI-Setup for details."
-                log.error(error)
-                raise IOError(error)
-            else:
-                raise e
-
-    def _sendData(self):
-        self.spi.xfer2(self._packet)
+import sys
+from collections import OrderedDict
+from . driver_base import ChannelOrder
+from . spi import SPIBase
+
+
+class APA102(SPIBase):
+    """Driver for APA102 and SK9822 strips connected directly to SPI
+    on systems like the Raspberry Pi and BeagleBone
+
+    `c_order`: `ChannelOrder` instance to define color channel order
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz
+
+    `hdr (bool)`: Use the per-pixel 5-bit brightness field for extra color depth at low levels.
+    See `APA102.set_device_brightness`.
+
+    `transport`: Optional `spixel.drivers.transport.SPITransport` to use instead of `dev`
+    """
+
+    pixel_bytes = 4  # 4 byte frames [bright, r, g, b]
+    channel_offset = 1
+    hdr_cache_size = 16
+    """Number of brightness levels whose HDR tables are kept"""
+
+    def __init__(self, c_order=ChannelOrder.BGR, dev="/dev/spidev0.0", SPISpeed=12, hdr=False, transport=None):
+        # gamma = [int(pow(float(i) / 255.0, 2.5) * 255.0 + 0.5) for i in range(256)]
+        gamma = [int(pow(float(i) / 255.0, 1.0 / 0.45) * 255.0) for i in range(256)]
+        super().__init__(c_order=c_order, dev=dev, SPISpeed=SPISpeed, gamma=gamma, transport=transport)
+
+        self.hdr = hdr
+        self._master_level = 0xFF
+        self._chipset_brightness = 0xFF >> 3
+        self._hdr_cache = OrderedDict()
+        self._hdr_bright = None
+        self._hdr_pwm = None
+        self._hdr_index = None
+
+    def setup(self, pixels):
+        super().setup(pixels)
+        if self.hdr:
+            # 16 bit (peak << 8 | value) indicies into _hdr_pwm
+            self._hdr_index = bytearray(self.num * 2)
+
+        self.set_device_brightness(self._master_level)  # required to setup _packet
+
+    # APA102/SK9822 requires latch bytes at the end)
+    # Many thanks to this article for combined APA102/SK9822 protocol
+    # https://cpldcpu.com/2016/12/13/sk9822-a-clone-of-the-apa102/
+    def _start_frame_bytes(self):
+        return bytes(4)  # start frame is [0, 0, 0, 0]
+
+    def _end_frame_bytes(self):
+        # reset frame for SK9822 [0, 0, 0, 0] then end frame
+        return bytes(4 + (self.num // 2) + 1)
 
     def set_device_brightness(self, val):
         """
@@ -84,22 +63,73 @@ class APA102(DriverBase):
         SK9822 uses a base 4.7kHz PWM but controls brightness with a variable current source.
         Because of this SK9822 will have much less flicker at lower levels.
         Either way, this option is better and faster than scaling in BiblioPixel
+
+        In `hdr` mode the brightness field is computed per pixel instead,
+        so `val` is applied while building the HDR tables.
         """
+        self._master_level = val
         self._chipset_brightness = (val >> 3)  # bitshift to scale from 8 bit to 5
-        self._brightness_list = [0xE0 + self._chipset_brightness] * self.num
-        self._packet[self._start_frame + 0:self._pixel_stop:4] = self._brightness_list
+        if self.hdr:
+            self._set_hdr_level(val)
+        elif self._packet:
+            self._packet[self._start_frame + 0:self._pixel_stop:4] = bytes([0xE0 + self._chipset_brightness]) * self.num
 
     def set_master_brightness(self, brightness):
         self.set_device_brightness(brightness)
         return True
 
-    def fix_data(self, data):
+    def _set_hdr_level(self, level):
+        tables = self._hdr_cache.pop(level, None)
+        if tables is None:
+            tables = self._build_hdr_tables(level)
+        self._hdr_cache[level] = tables
+        if len(self._hdr_cache) > self.hdr_cache_size:
+            self._hdr_cache.popitem(last=False)
+        self._hdr_bright, self._hdr_pwm = tables
+
+    @staticmethod
+    def _build_hdr_tables(level):
+        """Precompute the split of 16 bit gamma corrected intensities into
+        the 5-bit brightness field and 8-bit PWM values for master `level`.
+
+        The brightness of a pixel only depends on its brightest channel (`peak`),
+        so the brightness table maps peak -> brightness byte and the PWM table
+        maps `peak << 8 | value` -> PWM value for every channel of that pixel.
+        PWM values only depend on the brightness field, so the PWM table is
+        assembled from at most 31 distinct rows.
+
+        **returns:** `(brightness, pwm)` tables as `bytes`
+        """
+        g16 = [pow(i / 255.0, 1.0 / 0.45) * 65535.0 * level / 255.0 for i in range(256)]
+
+        rows = {0: bytes(256)}
+        bright = bytearray(256)
+        pwm = []
+        for peak in range(256):
+            b = -(-int(g16[peak] * 31) // 65535)  # ceil, smallest that keeps PWM <= 255
+            bright[peak] = 0xE0 + b
+            if b not in rows:
+                scale = 31.0 * 255.0 / (65535.0 * b)
+                rows[b] = bytes([min(255, int(g * scale + 0.5)) for g in g16])
+            pwm.append(rows[b])
+
+        return bytes(bright), b''.join(pwm)
+
+    def _fix_data_hdr(self, data):
+        start = self._start_frame
+        peak = bytes(map(max, data[0::3], data[1::3], data[2::3]))
+        self._packet[start:self._pixel_stop:4] = peak.translate(self._hdr_bright)
+
+        index = self._hdr_index
+        lo, hi = (0, 1) if sys.byteorder == 'little' else (1, 0)
+        index[hi::2] = peak
+        lookup = self._hdr_pwm.__getitem__
         for a, b in enumerate(self.c_order):
-            self._buf[a:self.num * 3:3] = [self.gamma[v] for v in data[b::3]]
-        self._packet[self._start_frame + 1:self._pixel_stop:4] = self._buf[0::3]
-        self._packet[self._start_frame + 2:self._pixel_stop:4] = self._buf[1::3]
-        self._packet[self._start_frame + 3:self._pixel_stop:4] = self._buf[2::3]
-
-    def _update(self, data):
-        self.fix_data(data)
-        self._sendData()
+            index[lo::2] = data[b::3]
+            self._packet[start + 1 + a:self._pixel_stop:4] = bytes(map(lookup, memoryview(index).cast('H')))
+
+    def fix_data(self, data):
+        if self.hdr:
+            self._fix_data_hdr(bytes(data))
+        else:
+            super().fix_data(data)
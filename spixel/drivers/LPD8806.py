@@ -0,0 +1,30 @@
+from . driver_base import ChannelOrder
+from . spi import SPIBase
+
+
+class LPD8806(SPIBase):
+    """Driver for LPD8806 strips connected directly to SPI
+    on systems like the Raspberry Pi and BeagleBone.
+
+    LPD8806 uses 7-bit color with the high bit of every byte set,
+    followed by one zero latch byte per 32 pixels.
+
+    `c_order`: `ChannelOrder` instance to define color channel order
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz
+
+    `gamma`: Gamma correction table (List of 256 values 0-255)
+
+    `transport`: Optional `spixel.drivers.transport.SPITransport` to use instead of `dev`
+    """
+
+    def __init__(self, c_order=ChannelOrder.GRB, dev="/dev/spidev0.0", SPISpeed=2, gamma=None, transport=None):
+        super().__init__(c_order=c_order, dev=dev, SPISpeed=SPISpeed, gamma=gamma, transport=transport)
+
+    def _end_frame_bytes(self):
+        return bytes((self.num + 31) // 32)
+
+    def _channel_value(self, value, channel):
+        return 0x80 | (value >> 1)
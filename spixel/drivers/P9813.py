@@ -0,0 +1,51 @@
+from . driver_base import ChannelOrder
+from . spi import SPIBase
+
+
+class P9813(SPIBase):
+    """Driver for P9813 strips (such as Grove Chainable RGB LEDs) connected directly to SPI
+    on systems like the Raspberry Pi and BeagleBone.
+
+    Each pixel is `[flag, B, G, R]` where the flag byte is `0b11`
+    followed by the inverted top two bits of B, G and R as a checksum.
+    The frame is wrapped in 4 zero bytes on each side.
+
+    `c_order`: `ChannelOrder` instance to define color channel order
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz
+
+    `gamma`: Gamma correction table (List of 256 values 0-255)
+
+    `transport`: Optional `spixel.drivers.transport.SPITransport` to use instead of `dev`
+    """
+
+    pixel_bytes = 4
+    channel_offset = 1
+
+    def __init__(self, c_order=ChannelOrder.BGR, dev="/dev/spidev0.0", SPISpeed=2, gamma=None, transport=None):
+        super().__init__(c_order=c_order, dev=dev, SPISpeed=SPISpeed, gamma=gamma, transport=transport)
+        self._flag_luts = None
+
+    def _start_frame_bytes(self):
+        return bytes(4)
+
+    def _end_frame_bytes(self):
+        return bytes(4)
+
+    def compile(self):
+        super().compile()
+        # each output slot contributes its inverted top 2 bits to the flag byte,
+        # slot 0 also carries the constant 0b11 prefix
+        self._flag_luts = [
+            bytes((0xC0 if a == 0 else 0) | ((~self.gamma[v] & 0xC0) >> (2 * (a + 1)))
+                  for v in range(256))
+            for a in range(3)]
+
+    def _encode_header(self, data):
+        # the three contributions never share bits, so OR them as one big integer
+        flags = 0
+        for a, b in enumerate(self.c_order):
+            flags |= int.from_bytes(data[b::3].translate(self._flag_luts[a]), 'big')
+        self._packet[self._start_frame:self._pixel_stop:4] = flags.to_bytes(self.num, 'big')
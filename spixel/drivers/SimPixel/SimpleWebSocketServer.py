@@ -18,10 +18,15 @@ import ssl
 import errno
 import codecs
 from collections import deque
-from select import select
+import selectors
+import time
+import zlib
 
 __all__ = ['WebSocket',
-           'SimpleWebSocketServer']
+           'SimpleWebSocketServer',
+           'encodeHeader',
+           'encodeMessage',
+           'deflateMessage']
 
 
 def _check_unicode(val):
@@ -72,6 +77,140 @@ PAYLOAD = 7
 
 MAXHEADER = 65536
 MAXPAYLOAD = 33554432
+MAXFRAMES = 1
+
+# permessage-deflate, messages smaller than DEFLATE_THRESHOLD are sent as is
+DEFLATE_THRESHOLD = 1024
+DEFLATE_LEVEL = 1
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+
+def encodeHeader(fin, opcode, length, rsv1=False):
+    """
+        Build the websocket frame header for a payload of length bytes.
+        fin is True if more fragments of the message will follow.
+        rsv1 marks a payload compressed with deflateMessage().
+    """
+    header = bytearray()
+
+    b1 = 0
+    b2 = 0
+    if fin is False:
+        b1 |= 0x80
+    if rsv1:
+        b1 |= 0x40
+    b1 |= opcode
+
+    header.append(b1)
+
+    if length <= 125:
+        b2 |= length
+        header.append(b2)
+
+    elif length >= 126 and length <= 65535:
+        b2 |= 126
+        header.append(b2)
+        header.extend(struct.pack("!H", length))
+
+    else:
+        b2 |= 127
+        header.append(b2)
+        header.extend(struct.pack("!Q", length))
+
+    return header
+
+
+def encodeMessage(fin, opcode, data):
+    """
+        Build a complete websocket frame for data.
+        fin is True if more fragments of the message will follow.
+    """
+    if _check_unicode(data):
+        data = data.encode('utf-8')
+
+    payload = encodeHeader(fin, opcode, len(data))
+    if len(data) > 0:
+        payload.extend(data)
+
+    return payload
+
+
+def deflateMessage(data, level=DEFLATE_LEVEL):
+    """
+        Compress one message payload for permessage-deflate (RFC 7692).
+        There is no context takeover, so the result can be sent to any
+        client that negotiated compression.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-len(DEFLATE_TAIL)]
+
+
+def inflateMessage(inflater, data, maxsize=MAXPAYLOAD):
+    """
+        Decompress one message payload with the client's decompressobj.
+    """
+    data = inflater.decompress(bytes(data) + DEFLATE_TAIL, maxsize)
+    if inflater.unconsumed_tail:
+        raise Exception('payload exceeded allowable size')
+    return data
+
+
+def negotiateDeflate(header):
+    """
+        Pick the first acceptable permessage-deflate offer from a
+        Sec-WebSocket-Extensions request header. Returns the response header
+        value, or None if no acceptable offer was made.
+    """
+    for offer in (header or '').split(','):
+        params = [p.strip() for p in offer.split(';')]
+        if params[0].lower() != 'permessage-deflate':
+            continue
+
+        response = ['permessage-deflate', 'server_no_context_takeover']
+        seen = set()
+        accept = True
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            name = name.strip().lower()
+            value = value.strip().strip('"')
+            if name in seen:
+                accept = False
+            seen.add(name)
+
+            if name in ('server_no_context_takeover', 'client_no_context_takeover'):
+                accept = accept and not value
+            elif name == 'client_max_window_bits':
+                # incoming messages are inflated with the full window
+                accept = accept and (not value or value.isdigit() and 8 <= int(value) <= 15)
+            elif name == 'server_max_window_bits':
+                # outgoing messages always use the full window
+                accept = accept and value == '15'
+                response.append('server_max_window_bits=15')
+            else:
+                accept = False
+
+        if accept:
+            return '; '.join(response)
+    return None
+
+
+def handshakeResponse(key, extensions=None):
+    """
+        Build the HTTP response accepting a websocket upgrade request.
+    """
+    k = key.encode('ascii') + GUID_STR.encode('ascii')
+    k_s = base64.b64encode(hashlib.sha1(k).digest()).decode('ascii')
+    hStr = HANDSHAKE_STR % {'acceptstr': k_s}
+    if extensions:
+        hStr = hStr[:-2] + 'Sec-WebSocket-Extensions: %s\r\n\r\n' % extensions
+    return hStr.encode('ascii')
+
+
+def _buffers(frame):
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        return (frame,)
+    return frame
 
 
 class WebSocket(object):
@@ -86,6 +225,7 @@ class WebSocket(object):
         self.headertoread = 2048
 
         self.fin = 0
+        self.rsv1 = 0
         self.data = bytearray()
         self.opcode = 0
         self.hasmask = 0
@@ -99,11 +239,26 @@ class WebSocket(object):
         self.frag_start = False
         self.frag_type = BINARY
         self.frag_buffer = None
+        self.frag_compressed = False
         self.frag_decoder = codecs.getincrementaldecoder(
             'utf-8')(errors='strict')
+
+        # permessage-deflate, set to None to never negotiate it
+        self.deflateThreshold = DEFLATE_THRESHOLD
+        self.deflate = False
+        self.inflater = None
         self.closed = False
         self.sendq = deque()
 
+        # latest-wins queue for frames that may be dropped, see sendLatest()
+        self.frameq = deque()
+        self.maxframes = MAXFRAMES
+        self.dropped = 0
+        # registered for write events, managed by the server
+        self.writing = False
+        # time.monotonic() deadline at which the server calls handleTimer()
+        self.timer = None
+
         self.state = HEADERB1
 
         # restrict the size of header and payload for security reasons
@@ -132,6 +287,22 @@ class WebSocket(object):
         """
         pass
 
+    def handleTimer(self):
+        """
+            Called from the server thread once time.monotonic() passes
+            self.timer. Set self.timer again to be called back later.
+        """
+        pass
+
+    def encodeLatest(self, frame):
+        """
+            Called on the server thread when a frame queued with sendLatest()
+            is about to be written to the socket. Returns what to send, as
+            for sendEncoded(). Override to encode frames as late as possible,
+            frames dropped from the queue are then never encoded.
+        """
+        return frame
+
     def _handlePacket(self):
         if self.opcode == CLOSE:
             pass
@@ -180,9 +351,10 @@ class WebSocket(object):
 
                 self.frag_type = self.opcode
                 self.frag_start = True
+                self.frag_compressed = bool(self.rsv1)
                 self.frag_decoder.reset()
 
-                if self.frag_type == TEXT:
+                if self.frag_type == TEXT and not self.frag_compressed:
                     self.frag_buffer = []
                     utf_str = self.frag_decoder.decode(self.data, final=False)
                     if utf_str:
@@ -195,7 +367,7 @@ class WebSocket(object):
                 if self.frag_start is False:
                     raise Exception('fragmentation protocol error')
 
-                if self.frag_type == TEXT:
+                if self.frag_type == TEXT and not self.frag_compressed:
                     utf_str = self.frag_decoder.decode(self.data, final=False)
                     if utf_str:
                         self.frag_buffer.append(utf_str)
@@ -207,7 +379,12 @@ class WebSocket(object):
                 if self.frag_start is False:
                     raise Exception('fragmentation protocol error')
 
-                if self.frag_type == TEXT:
+                if self.frag_compressed:
+                    self.frag_buffer.extend(self.data)
+                    self.data = self._inflate(self.frag_buffer)
+                    if self.frag_type == TEXT:
+                        self.data = self._decodeText(self.data)
+                elif self.frag_type == TEXT:
                     utf_str = self.frag_decoder.decode(self.data, final=True)
                     self.frag_buffer.append(utf_str)
                     self.data = u''.join(self.frag_buffer)
@@ -220,6 +397,7 @@ class WebSocket(object):
                 self.frag_decoder.reset()
                 self.frag_type = BINARY
                 self.frag_start = False
+                self.frag_compressed = False
                 self.frag_buffer = None
 
             elif self.opcode == PING:
@@ -232,14 +410,23 @@ class WebSocket(object):
                 if self.frag_start is True:
                     raise Exception('fragmentation protocol error')
 
+                if self.rsv1:
+                    self.data = self._inflate(self.data)
+
                 if self.opcode == TEXT:
-                    try:
-                        self.data = self.data.decode('utf8', errors='strict')
-                    except Exception:
-                        raise Exception('invalid utf-8 payload')
+                    self.data = self._decodeText(self.data)
 
                 self.handleMessage()
 
+    def _decodeText(self, data):
+        try:
+            return data.decode('utf8', errors='strict')
+        except Exception:
+            raise Exception('invalid utf-8 payload')
+
+    def _inflate(self, data):
+        return inflateMessage(self.inflater, data, self.maxpayload)
+
     def _handleData(self):
         # do the HTTP header and handshake
         if self.handshaked is False:
@@ -262,11 +449,15 @@ class WebSocket(object):
                     # handshake rfc 6455
                     try:
                         key = self.request.headers['Sec-WebSocket-Key']
-                        k = key.encode('ascii') + GUID_STR.encode('ascii')
-                        k_s = base64.b64encode(
-                            hashlib.sha1(k).digest()).decode('ascii')
-                        hStr = HANDSHAKE_STR % {'acceptstr': k_s}
-                        self.sendq.append((BINARY, hStr.encode('ascii')))
+                        extensions = None
+                        if self.deflateThreshold is not None:
+                            extensions = negotiateDeflate(', '.join(
+                                self.request.headers.get_all('Sec-WebSocket-Extensions', [])))
+                        if extensions:
+                            self.deflate = True
+                            self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                        response = handshakeResponse(key, extensions)
+                        self.sendq.append((BINARY, (response,)))
                         self.handshaked = True
                         self.handleConnected()
                     except Exception as e:
@@ -307,31 +498,47 @@ class WebSocket(object):
         finally:
             self.closed = True
 
-    def _sendBuffer(self, buff):
-        size = len(buff)
-        tosend = size
-        already_sent = 0
+    def _sendBuffer(self, buffers):
+        """
+            Send a sequence of buffers, gathered into one sendmsg() call per
+            attempt. Returns None when everything was sent, otherwise a list
+            of memoryviews over the bytes still to send.
+        """
+        views = [memoryview(b) for b in buffers]
 
-        while tosend > 0:
+        while views:
             try:
-                # i should be able to send a bytearray
-                sent = self.client.send(buff[already_sent:])
+                sent = self._sendViews(views)
                 if sent == 0:
                     raise RuntimeError('socket connection broken')
 
-                already_sent += sent
-                tosend -= sent
-
             except socket.error as e:
                 # if we have full buffers then wait for them to drain and try
                 # again
                 if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                    return buff[already_sent:]
+                    return views
                 else:
                     raise e
 
+            # drop what was sent without copying what is left
+            while sent:
+                size = views[0].nbytes
+                if sent >= size:
+                    views.pop(0)
+                    sent -= size
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+
         return None
 
+    def _sendViews(self, views):
+        try:
+            return self.client.sendmsg(views)
+        except (AttributeError, NotImplementedError):
+            # ssl sockets have no scatter-gather send
+            return self.client.send(views[0])
+
     def sendFragmentStart(self, data):
         """
             Send the start of a data fragment stream to a websocket client.
@@ -374,48 +581,55 @@ class WebSocket(object):
         opcode = BINARY
         if _check_unicode(data):
             opcode = TEXT
-        self._sendMessage(False, opcode, data)
-
-    def _sendMessage(self, fin, opcode, data):
-
-        payload = bytearray()
-
-        b1 = 0
-        b2 = 0
-        if fin is False:
-            b1 |= 0x80
-        b1 |= opcode
-
-        if _check_unicode(data):
             data = data.encode('utf-8')
 
-        length = len(data)
-        payload.append(b1)
+        if self.deflate and len(data) >= self.deflateThreshold:
+            compressed = deflateMessage(data)
+            if len(compressed) < len(data):
+                header = encodeHeader(False, opcode, len(compressed), rsv1=True)
+                self.sendq.append((opcode, (bytes(header), compressed)))
+                return
 
-        if length <= 125:
-            b2 |= length
-            payload.append(b2)
+        self._sendMessage(False, opcode, data)
 
-        elif length >= 126 and length <= 65535:
-            b2 |= 126
-            payload.append(b2)
-            payload.extend(struct.pack("!H", length))
+    def sendEncoded(self, frame, opcode=BINARY):
+        """
+            Queue a frame already built with encodeMessage(), or a sequence
+            of buffers (such as an encodeHeader() and its payload) that are
+            sent back to back. Frames can be shared by any number of clients.
+        """
+        self.sendq.append((opcode, _buffers(frame)))
 
-        else:
-            b2 |= 127
-            payload.append(b2)
-            payload.extend(struct.pack("!Q", length))
+    def sendLatest(self, frame, opcode=BINARY):
+        """
+            Queue a frame, as for sendEncoded(), that may be replaced.
+            At most maxframes such frames wait for a slow client, older
+            ones are discarded and counted in dropped. Frames queued with
+            any other send method are never discarded. The frame is passed
+            through encodeLatest() when it is dequeued for the socket.
+            Must be called on the server thread, which also drains frameq.
+        """
+        if len(self.frameq) >= self.maxframes:
+            self.frameq.popleft()
+            self.dropped += 1
+        self.frameq.append((opcode, frame))
 
-        if length > 0:
-            payload.extend(data)
+    @property
+    def queueDepth(self):
+        """
+            Number of frames waiting to be sent.
+        """
+        return len(self.sendq) + len(self.frameq)
 
-        self.sendq.append((opcode, payload))
+    def _sendMessage(self, fin, opcode, data):
+        self.sendq.append((opcode, (encodeMessage(fin, opcode, data),)))
 
     def _parseMessage(self, byte):
         # read in the header
         if self.state == HEADERB1:
 
             self.fin = byte & 0x80
+            self.rsv1 = byte & 0x40
             self.opcode = byte & 0x0F
             self.state = HEADERB2
 
@@ -425,7 +639,9 @@ class WebSocket(object):
             self.data = bytearray()
 
             rsv = byte & 0x70
-            if rsv != 0:
+            if rsv == 0x40 and self.deflate and self.opcode in (TEXT, BINARY):
+                pass  # compressed message
+            elif rsv != 0:
                 raise Exception('RSV bit must be 0')
 
         elif self.state == HEADERB2:
@@ -568,16 +784,28 @@ class WebSocket(object):
 
 class SimpleWebSocketServer(object):
     def __init__(
-            self, host, port, websocketclass, selectInterval=0.1, **kwargs):
+            self, host, port, websocketclass, selectInterval=None, **kwargs):
         self.websocketclass = websocketclass
         self.websock_kwargs = kwargs
         self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.serversocket.bind((host, port))
         self.serversocket.listen(5)
+        self.serversocket.setblocking(0)
+        # None blocks until there is socket activity or wakeup() is called
         self.selectInterval = selectInterval
         self.connections = {}
-        self.listeners = [self.serversocket]
+        self.closing = False
+        self.serving = False
+
+        # other threads write to _wakeup_w to interrupt select()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(0)
+        self._wakeup_w.setblocking(0)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.serversocket, selectors.EVENT_READ)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
 
     def _decorateSocket(self, sock):
         return sock
@@ -585,16 +813,46 @@ class SimpleWebSocketServer(object):
     def _constructWebSocket(self, sock, address):
         return self.websocketclass(self, sock, address, **self.websock_kwargs)
 
+    def wakeup(self):
+        """
+            Interrupt select() and call handleWakeup() on the server thread.
+            Safe to call from any thread, never blocks.
+        """
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending, or the server is closed
+
+    def handleWakeup(self):
+        """
+            Called on the server thread after wakeup(). Several wakeups may
+            be coalesced into one call.
+        """
+        pass
+
     def close(self):
-        self.serversocket.close()
+        self.closing = True
+        if self.serving:
+            self.wakeup()  # serveforever() cleans up on exit
+        else:
+            self._cleanup()
 
-        for desc, conn in self.connections.items():
+    def _cleanup(self):
+        for fileno, conn in list(self.connections.items()):
             conn.close()
             conn.handleClose()
+            conn.client.close()
+        self.connections = {}
 
-    def _kill_client(self, client, client_id, exception=True):
-        del self.connections[id]
-        self.listeners.remove(id)
+        self.selector.close()
+        self.serversocket.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def _kill_client(self, client, fileno, exception=True):
+        if self.connections.pop(fileno, None) is None:
+            return
+        self.selector.unregister(client.client)
         client.client.close()
         client.handleClose()
 
@@ -602,65 +860,106 @@ class SimpleWebSocketServer(object):
             import traceback
             traceback.print_exc()
 
-    def serveforever(self):
-        while True:
-            writers = []
-            for fileno in self.listeners:
-                if fileno == self.serversocket:
-                    continue
-                client = self.connections[fileno]
+    def _updateInterest(self):
+        for fileno, client in self.connections.items():
+            writing = bool(client.sendq or client.frameq)
+            if writing != client.writing:
+                client.writing = writing
+                events = selectors.EVENT_READ
+                if writing:
+                    events |= selectors.EVENT_WRITE
+                self.selector.modify(client.client, events, client)
+
+    def _selectTimeout(self):
+        timeout = self.selectInterval
+        timers = [c.timer for c in self.connections.values() if c.timer is not None]
+        if timers:
+            wait = max(0, min(timers) - time.monotonic())
+            timeout = wait if timeout is None else min(timeout, wait)
+        return timeout
+
+    def _runTimers(self):
+        now = time.monotonic()
+        for fileno, client in list(self.connections.items()):
+            if client.timer is not None and client.timer <= now:
+                client.timer = None
+                try:
+                    client.handleTimer()
+                except Exception:
+                    self._kill_client(client, fileno)
+
+    def _sendQueued(self, client, fileno):
+        try:
+            while client.sendq or client.frameq:
+                # control frames and partial sends go first
                 if client.sendq:
-                    writers.append(fileno)
+                    opcode, payload = client.sendq.popleft()
+                else:
+                    opcode, frame = client.frameq.popleft()
+                    payload = _buffers(client.encodeLatest(frame))
+                remaining = client._sendBuffer(payload)
+                if remaining is not None:
+                    client.sendq.appendleft((opcode, remaining))
+                    break
+                else:
+                    if opcode == CLOSE:
+                        raise Exception('received client close')
 
-            if self.selectInterval:
-                rList, wList, xList = select(
-                    self.listeners, writers,
-                    self.listeners, self.selectInterval)
-            else:
-                rList, wList, xList = select(
-                    self.listeners, writers, self.listeners)
+        except Exception:
+            self._kill_client(client, fileno)
 
-            for ready in wList:
-                client = self.connections[ready]
-                try:
-                    while client.sendq:
-                        opcode, payload = client.sendq.popleft()
-                        remaining = client._sendBuffer(payload)
-                        if remaining is not None:
-                            client.sendq.appendleft((opcode, remaining))
-                            break
-                        else:
-                            if opcode == CLOSE:
-                                raise Exception('received client close')
+    def _accept(self):
+        sock = None
+        try:
+            sock, address = self.serversocket.accept()
+            # frames are complete messages, don't let Nagle hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            newsock = self._decorateSocket(sock)
+            newsock.setblocking(0)
+            fileno = newsock.fileno()
+            client = self._constructWebSocket(newsock, address)
+            self.connections[fileno] = client
+            self.selector.register(newsock, selectors.EVENT_READ, client)
+        except Exception:
+            if sock is not None:
+                sock.close()
 
-                except Exception:
-                    self._kill_client(client, ready)
+    def serveforever(self):
+        self.serving = True
+        try:
+            while not self.closing:
+                self._updateInterest()
 
-            for ready in rList:
-                if ready == self.serversocket:
-                    try:
-                        sock, address = self.serversocket.accept()
-                        newsock = self._decorateSocket(sock)
-                        newsock.setblocking(0)
-                        fileno = newsock.fileno()
-                        self.connections[fileno] = self._constructWebSocket(
-                            newsock, address)
-                        self.listeners.append(fileno)
-                    except Exception:
-                        if sock is not None:
-                            sock.close()
-                else:
-                    if ready not in self.connections:
+                for key, events in self.selector.select(self._selectTimeout()):
+                    sock = key.fileobj
+                    if sock is self._wakeup_r:
+                        try:
+                            while self._wakeup_r.recv(4096):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        self.handleWakeup()
                         continue
-                    client = self.connections[ready]
-                    try:
-                        client._handleData()
-                    except Exception:
-                        self._kill_client(client, ready)
-
-            for failed in xList:
-                if failed == self.serversocket:
-                    self.close()
-                    raise Exception('server socket failed')
-                if failed in self.connections:
-                    self._kill_client(self.connections[failed], failed, False)
+
+                    if sock is self.serversocket:
+                        self._accept()
+                        continue
+
+                    client = key.data
+                    fileno = key.fd
+                    if fileno not in self.connections:
+                        continue
+
+                    if events & selectors.EVENT_WRITE:
+                        self._sendQueued(client, fileno)
+
+                    if events & selectors.EVENT_READ and fileno in self.connections:
+                        try:
+                            client._handleData()
+                        except Exception:
+                            self._kill_client(client, fileno)
+
+                self._runTimers()
+        finally:
+            self.serving = False
+            self._cleanup()
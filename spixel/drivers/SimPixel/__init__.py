@@ -1,6 +1,6 @@
 import errno, struct, threading, uuid
 from .. driver_base import DriverBase
-from . websocket import Server
+from . websocket import Server, Client, PixelFrame
 from time import sleep
 
 ADDRESS_IN_USE_ERROR = """
@@ -10,16 +10,63 @@ Perhaps BiblioPixel is already running on your machine?
 """
 
 class SimPixel(DriverBase):
-
-    def __init__(self, port=1337, pixel_positions=None, **kwds):
+    """Streams pixel data to SimPixel viewers over websockets.
+
+    All packets are binary websocket messages starting with a 2 byte type:
+
+    - `00 00` position packet, sent once on connect: `<h` x, y, z per pixel
+    - `00 01` pixel packet: `R,G,B` for every pixel
+    - `00 02` delta packet: zero or more runs of
+      `<I` first pixel index, `<H` pixel count, then `R,G,B` for those pixels.
+      Pixels not covered by a run are unchanged since the last packet.
+
+    Delta packets are only sent to viewers that connect with `?delta=1` in
+    the websocket URL. Deltas are against the last packet sent to that
+    viewer. A viewer gets a delta when it is at most `delta_ratio` the size
+    of a full packet and fewer than `keyframe_interval` deltas were sent
+    since the last full packet. Otherwise a full pixel packet is sent as a
+    keyframe.
+
+    Viewers may send JSON text messages to change their stream:
+
+    - `{"fps": 15}` caps the frame rate sent to that viewer, `0` removes the cap.
+      Updates in between are skipped, the latest one is sent when the next
+      slot comes up.
+    - `{"delta": true}` or `{"delta": false}` switches delta packets on or off.
+
+    Viewers that offer permessage-deflate (RFC 7692) get packets of at least
+    `compress_threshold` bytes compressed. Each packet is compressed once and
+    shared by all such viewers.
+    """
+
+    def __init__(self, port=1337, pixel_positions=None, max_queued_frames=1,
+                 delta_ratio=0.5, keyframe_interval=60, delta_block=8,
+                 compress_threshold=1024, **kwds):
         """
         Args:
             port:  the port on which the SimPixel server is running.
             pixel_positions:  the positions of the LEDs in 3-d space.
+            max_queued_frames:  pixel frames kept per client while it catches up,
+                older ones are dropped so slow viewers always get the latest frame.
+            delta_ratio:  largest delta size, relative to a full frame, worth sending.
+            keyframe_interval:  maximum number of deltas between full frames.
+            delta_block:  granularity in pixels at which changes are detected.
+            compress_threshold:  smallest packet in bytes worth compressing,
+                `None` to never negotiate compression.
             **kwds:  keywords passed to `spixel.drivers.driver_base.DriverBase`.
         """
         super().__init__(**kwds)
         self.port = port
+        self.max_queued_frames = max_queued_frames
+        self.delta_ratio = delta_ratio
+        self.keyframe_interval = keyframe_interval
+        self.delta_block = delta_block
+        self.compress_threshold = compress_threshold
+        # (seq, bytes) of the latest update, replaced as a whole by the render
+        # thread and read by the server thread, so no lock is needed
+        self._latest = None
+        self._seq = 0
+        self._published = 0
         self.pixel_positions = self.server = self.thread = None
         self.websocks = {}
 
@@ -36,7 +83,7 @@ class SimPixel(DriverBase):
 
     def start(self):
         try:
-            self.server = Server(self.port, driver=self, selectInterval=0.001)
+            self.server = Server(self.port, driver=self)
 
         except OSError as e:
             if e.errno == errno.EADDRINUSE:
@@ -51,8 +98,8 @@ class SimPixel(DriverBase):
             self.pixel_positions = bytearray(struct.pack('<%sh' % len(pl), *pl))
 
 
-    def add_websock(self, oid, send_pixels):
-        self.websocks[oid] = send_pixels
+    def add_websock(self, oid, client):
+        self.websocks[oid] = client
 
     def remove_websock(self, oid):
         try:
@@ -60,14 +107,35 @@ class SimPixel(DriverBase):
         except KeyError:
             pass
 
+    def client_stats(self):
+        """Returns a dict of `{address: (queue_depth, dropped_frames, skipped_frames)}`
+        for all connected clients. Frames are dropped when a client can't keep
+        up and skipped when they exceed the frame rate it asked for."""
+        return {ws.address: (ws.queueDepth, ws.dropped, ws.skipped)
+                for ws in list(self.websocks.values())}
+
     def cleanup(self):
         print('Closing websocket server...')
         self.server.close()
 
+    def _publish(self):
+        """Encode the latest snapshot once and hand the frame to every client.
+        Runs on the server thread, intermediate snapshots are skipped."""
+        latest = self._latest
+        if latest is None or latest[0] == self._published:
+            return
+        seq, data = latest
+        self._published = seq
+        frame = PixelFrame(seq, data, self.delta_block)
+        for ws in list(self.websocks.values()):
+            ws.send_pixels(frame)
+
     def _update(self, data):
-        self._buf = data
-        for ws in self.websocks.values():
-            ws(self._buf)
+        # copy the finished buffer and hand it over in a single assignment,
+        # the server thread does all encoding and network IO
+        self._seq += 1
+        self._latest = (self._seq, bytes(data))
+        self.server.wakeup()
 
 
 __pdoc__ = {}
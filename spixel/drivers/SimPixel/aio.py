@@ -0,0 +1,213 @@
+import asyncio, struct, time, uuid, zlib
+from ... import log
+from . import SimPixel
+from . websocket import Client, wants_delta, apply_control, next_slot
+from . SimpleWebSocketServer import (
+    HTTPRequest, MAXHEADER, MAXPAYLOAD, encodeHeader, encodeMessage,
+    deflateMessage, inflateMessage, negotiateDeflate, handshakeResponse,
+    STREAM, TEXT, BINARY, CLOSE, PING, PONG)
+
+
+class AsyncClient(object):
+    """One viewer connected to `AsyncSimPixel`. Pixel frames are latest-wins:
+    while the socket drains or the frame rate cap holds a frame back, newer
+    frames replace the pending one. Frames are encoded when they are written,
+    so replaced frames never break the delta chain."""
+
+    def __init__(self, driver, reader, writer):
+        self.driver = driver
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.oid = uuid.uuid1()
+        self.pending = None
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        # delta state, see PixelFrame.encode_for
+        self.delta_ratio = None
+        self.keyframe_interval = driver.keyframe_interval
+        self.last_frame = None
+        self.since_key = 0
+        # frame rate cap, see apply_control
+        self.frame_interval = 0
+        self.next_frame = 0
+        self.skipped = 0
+        # permessage-deflate, negotiated in _handshake
+        self.deflateThreshold = driver.compress_threshold
+        self.deflate = False
+        self.inflater = None
+
+    @property
+    def queueDepth(self):
+        return 1 if self.pending is not None else 0
+
+    def send_pixels(self, frame):
+        if self.pending is not None:
+            if self.frame_interval and time.monotonic() < self.next_frame:
+                self.skipped += 1
+            else:
+                self.dropped += 1
+        self.pending = frame
+        self.ready.set()
+
+    async def _handshake(self):
+        header = await self.reader.readuntil(b'\r\n\r\n')
+        if len(header) >= MAXHEADER:
+            raise Exception('header exceeded allowable size')
+        request = HTTPRequest(header)
+        if wants_delta(request.path):
+            self.delta_ratio = self.driver.delta_ratio
+        extensions = None
+        if self.deflateThreshold is not None:
+            extensions = negotiateDeflate(', '.join(
+                request.headers.get_all('Sec-WebSocket-Extensions', [])))
+        if extensions:
+            self.deflate = True
+            self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        key = request.headers['Sec-WebSocket-Key']
+        self.writer.write(handshakeResponse(key, extensions))
+
+    def _message(self, data):
+        """Websocket frame for one binary message, compressed if negotiated"""
+        if self.deflate and len(data) >= self.deflateThreshold:
+            compressed = deflateMessage(data)
+            if len(compressed) < len(data):
+                return encodeHeader(False, BINARY, len(compressed), rsv1=True) + compressed
+        return encodeMessage(False, BINARY, data)
+
+    async def _read(self):
+        """Handle frames from the viewer until it closes the connection.
+        Applies the same checks as the threaded server's frame parser.
+        Fragmented messages are not supported and close the connection."""
+        while True:
+            b1, b2 = await self.reader.readexactly(2)
+            fin = b1 & 0x80
+            rsv = b1 & 0x70
+            opcode = b1 & 0x0F
+            length = b2 & 0x7F
+
+            if opcode not in (TEXT, BINARY, CLOSE, PING, PONG, STREAM):
+                raise Exception('unknown opcode')
+            if rsv == 0x40 and self.deflate and opcode in (TEXT, BINARY):
+                pass  # compressed message
+            elif rsv != 0:
+                raise Exception('RSV bit must be 0')
+            if opcode in (CLOSE, PING, PONG) and (length > 125 or not fin):
+                raise Exception('control frame length can not be > 125 or fragmented')
+            if opcode == STREAM or not fin:
+                self.writer.write(encodeMessage(False, CLOSE, struct.pack('!H', 1003)))
+                raise Exception('fragmented messages are not supported')
+
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            if length > MAXPAYLOAD:
+                raise Exception('payload exceeded allowable size')
+
+            mask = await self.reader.readexactly(4) if b2 & 0x80 else None
+            data = await self.reader.readexactly(length)
+            if mask:
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+            if rsv:
+                data = inflateMessage(self.inflater, data, MAXPAYLOAD)
+
+            if opcode == CLOSE:
+                self.writer.write(encodeMessage(False, CLOSE, data[:2]))
+                return
+            elif opcode == PING:
+                self.writer.write(encodeMessage(False, PONG, data))
+            elif opcode == TEXT:
+                apply_control(self, data.decode('utf-8', 'replace'))
+
+    async def _write(self):
+        while True:
+            await self.ready.wait()
+            if self.frame_interval:
+                delay = self.next_frame - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.next_frame = next_slot(self, time.monotonic())
+            self.ready.clear()
+            frame, self.pending = self.pending, None
+            self.writer.writelines(frame.encode_for(self))
+            await self.writer.drain()
+
+    async def serve(self):
+        await self._handshake()
+        self.writer.write(self._message(bytes(Client.POSITION_START + self.driver.pixel_positions)))
+        self.driver.add_websock(self.oid, self)
+        log.debug('Connected:{}'.format(self.address))
+
+        writer = asyncio.ensure_future(self._write())
+        try:
+            await self._read()
+        finally:
+            writer.cancel()
+            self.driver.remove_websock(self.oid)
+            log.debug('Closed:{}'.format(self.address))
+
+
+class AsyncSimPixel(SimPixel):
+    """`spixel.drivers.SimPixel.SimPixel` served from an existing asyncio
+    event loop instead of its own thread. Packet formats are identical.
+
+    The server is not started by `setup`, await `AsyncSimPixel.start` from
+    the loop instead. `update` may be called from the loop or from any
+    other thread.
+
+        driver = AsyncSimPixel(port=1337)
+        pixels = Pixels(driver, 100)
+        await driver.start()
+    """
+
+    def __init__(self, port=1337, pixel_positions=None, host='', **kwds):
+        """
+        Args:
+            port:  the port on which the SimPixel server is running.
+            pixel_positions:  the positions of the LEDs in 3-d space.
+            host:  interface to listen on, all interfaces by default.
+            **kwds:  keywords passed to `spixel.drivers.SimPixel.SimPixel`.
+        """
+        super().__init__(port=port, pixel_positions=pixel_positions, **kwds)
+        self.host = host
+        self.loop = None
+
+    def setup(self, pixels):
+        super(SimPixel, self).setup(pixels)
+
+    async def start(self):
+        """Start listening on the running event loop"""
+        self.loop = asyncio.get_event_loop()
+        self.server = await asyncio.start_server(self._serve_client, self.host or None, self.port)
+        log.info('Starting asyncio WebSocket server on port %s...', self.port)
+
+    async def stop(self):
+        """Stop listening and disconnect all viewers"""
+        self.server.close()
+        for ws in list(self.websocks.values()):
+            ws.writer.close()
+        await self.server.wait_closed()
+        log.info('WebSocket server closed')
+
+    def cleanup(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def _serve_client(self, reader, writer):
+        client = AsyncClient(self, reader, writer)
+        try:
+            await client.serve()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            log.debug('Client {} failed: {}'.format(client.address, e))
+        finally:
+            writer.close()
+
+    def _update(self, data):
+        if self.loop is None:
+            return
+        self._seq += 1
+        self._latest = (self._seq, bytes(data))
+        self.loop.call_soon_threadsafe(self._publish)
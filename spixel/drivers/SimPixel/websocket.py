@@ -1,26 +1,194 @@
-import threading, uuid
+import json, struct, threading, time, uuid
+from urllib.parse import urlparse, parse_qs
 from ... import log
-from . SimpleWebSocketServer import WebSocket, SimpleWebSocketServer
+from . SimpleWebSocketServer import (
+    WebSocket, SimpleWebSocketServer, encodeHeader, deflateMessage, BINARY)
+
+POSITION_START = bytearray([0x00, 0x00])
+PIXEL_START = bytearray([0x00, 0x01])
+PIXEL_DELTA = bytearray([0x00, 0x02])
+
+MAX_RUN = 0xFFFF  # pixel count of a delta run is 16 bit
+
+
+def wants_delta(path):
+    """True if the websocket request path opts into delta frames (`/?delta=1`)"""
+    query = parse_qs(urlparse(path or '').query)
+    return query.get('delta', ['0'])[0] not in ('0', 'false', '')
+
+
+def encode_delta(previous, data, block=8):
+    """Build a `PIXEL_DELTA` packet of the runs of `block` pixels that
+    differ between `previous` and `data`"""
+    payload = bytearray(PIXEL_DELTA)
+    if previous == data:
+        return payload
+
+    step = block * 3
+    size = len(data)
+    start = None
+    for i in range(0, size, step):
+        if data[i:i + step] != previous[i:i + step]:
+            if start is None:
+                start = i
+        elif start is not None:
+            _add_run(payload, data, start, i)
+            start = None
+    if start is not None:
+        _add_run(payload, data, start, size)
+    return payload
+
+
+def _add_run(payload, data, start, stop):
+    for a in range(start, stop, MAX_RUN * 3):
+        b = min(stop, a + MAX_RUN * 3)
+        payload.extend(struct.pack('<IH', a // 3, (b - a) // 3))
+        payload.extend(data[a:b])
+
+
+FULL = 'full'  # PixelFrame variant key of the full frame, deltas use their base seq
+
+
+class PixelFrame(object):
+    """One pixel update shared by all clients. The full encoding, the
+    deltas against earlier updates and their compressed forms are built the
+    first time a client needs them."""
+
+    def __init__(self, seq, data, block=8):
+        self.seq = seq
+        self.data = data
+        self.block = block
+        self._full = None
+        self._deltas = {}
+        self._deflated = {}
+
+    @property
+    def full(self):
+        if self._full is None:
+            self._full = Client.encode_pixels(self.data)
+        return self._full
+
+    def delta(self, base):
+        """Returns `(buffers, ratio)` for the delta against the earlier frame
+        `base`, where ratio is its size relative to the full frame. Cached per
+        base, so clients at the same point in the stream share one delta."""
+        delta = self._deltas.get(base.seq)
+        if delta is None:
+            payload = bytes(encode_delta(base.data, self.data, self.block))
+            ratio = len(payload) / (len(self.data) + len(PIXEL_START))
+            buffers = (bytes(encodeHeader(False, BINARY, len(payload))), payload)
+            delta = self._deltas[base.seq] = (buffers, ratio)
+        return delta
+
+    def deflated(self, key):
+        """Compressed frame for variant `key`, either `FULL` or the base seq
+        of a delta already built. `None` if compression doesn't shrink it."""
+        if key not in self._deflated:
+            if key == FULL:
+                payload = bytes(PIXEL_START) + self.data
+            else:
+                payload = self._deltas[key][0][1]
+            data = deflateMessage(payload)
+            self._deflated[key] = None
+            if len(data) < len(payload):
+                header = encodeHeader(False, BINARY, len(data), rsv1=True)
+                self._deflated[key] = (bytes(header), data)
+        return self._deflated[key]
+
+    def encode_for(self, client):
+        """Pick the encoding for `client` and update its delta state. Must be
+        called just before the frame is written to the client's socket, so
+        deltas are against the last frame the client was actually sent.
+        A delta is only used if the client opted in, is not due a keyframe
+        and the delta is small enough.
+        Clients that negotiated compression get the compressed frame when it
+        is at least `deflateThreshold` bytes."""
+        base = client.last_frame
+        client.last_frame = self
+        key, buffers = FULL, None
+        if (client.delta_ratio is not None and
+                base is not None and
+                len(base.data) == len(self.data) and
+                client.since_key < client.keyframe_interval):
+            delta, ratio = self.delta(base)
+            if ratio <= client.delta_ratio:
+                key, buffers = base.seq, delta
+        if buffers is None:
+            client.since_key = 0
+            buffers = self.full
+        else:
+            client.since_key += 1
+
+        if client.deflate and len(buffers[-1]) >= client.deflateThreshold:
+            return self.deflated(key) or buffers
+        return buffers
+
+
+def apply_control(client, text):
+    """Apply a JSON control message sent by a viewer, such as
+    `{"fps": 15, "delta": true}`. `fps` caps the frame rate sent to the
+    client, 0 removes the cap. `delta` switches delta frames on or off.
+    Unknown keys are ignored."""
+    try:
+        msg = json.loads(text)
+    except ValueError:
+        log.debug('Invalid control message: %r', text)
+        return
+    if not isinstance(msg, dict):
+        log.debug('Invalid control message: %r', text)
+        return
+
+    if 'fps' in msg:
+        fps = msg['fps']
+        if isinstance(fps, (int, float)) and not isinstance(fps, bool) and fps >= 0:
+            client.frame_interval = 1.0 / fps if fps else 0
+        else:
+            log.debug('Invalid fps in control message: %r', fps)
+    if 'delta' in msg:
+        client.delta_ratio = client.driver.delta_ratio if msg['delta'] else None
+
+
+def next_slot(client, now):
+    """Time at which a rate capped `client` that was just sent a frame at
+    `now` may get the next one, one frame interval later. A slot that has
+    already passed, such as the first one or one left over from an idle
+    gap, is not carried over, so two frames never go out back to back."""
+    if client.next_frame <= now:
+        return now + client.frame_interval
+    return client.next_frame + client.frame_interval
 
 
 class Client(WebSocket):
-    POSITION_START = bytearray([0x00, 0x00])
-    PIXEL_START = bytearray([0x00, 0x01])
+    POSITION_START = POSITION_START
+    PIXEL_START = PIXEL_START
 
     def __init__(self, *args, driver):
         super().__init__(*args)
         self.driver = driver
+        self.maxframes = driver.max_queued_frames
+        self.deflateThreshold = driver.compress_threshold
         self.connected = False
         self.oid = None
+        # delta state, see PixelFrame.encode_for
+        self.delta_ratio = None
+        self.keyframe_interval = driver.keyframe_interval
+        self.last_frame = None
+        self.since_key = 0
+        # frame rate cap, see apply_control
+        self.frame_interval = 0
+        self.next_frame = 0
+        self.deferred = None
+        self.skipped = 0
         log.debug('Server started...')
 
     def handleConnected(self):
         log.debug('Connected:{}'.format(self.address))
         self.connected = True
         self.oid = uuid.uuid1()
-        self.driver.add_websock(self.oid, self.send_pixels)
-        self.sendFragmentStart(self.POSITION_START)
-        self.sendFragmentEnd(self.driver.pixel_positions)
+        if wants_delta(self.request.path):
+            self.delta_ratio = self.driver.delta_ratio
+        self.driver.add_websock(self.oid, self)
+        self.sendMessage(self.POSITION_START + self.driver.pixel_positions)
 
     def handleClose(self):
         self.driver.remove_websock(self.oid)
@@ -28,24 +196,70 @@ class Client(WebSocket):
         log.debug('Closed:{}'.format(self.address))
 
     def handleMessage(self):
-        pass
+        if isinstance(self.data, str):
+            apply_control(self, self.data)
+
+    def encodeLatest(self, frame):
+        return frame.encode_for(self)
+
+    def handleTimer(self):
+        frame, self.deferred = self.deferred, None
+        if frame is not None:
+            self._send_frame(frame)
 
-    def send_pixels(self, pixels):
+    @classmethod
+    def encode_pixels(cls, pixels):
+        """Build the websocket message for one pixel update, to be shared by all clients.
+        Returns `(header, pixels)` buffers so the pixel data is never copied."""
+        header = encodeHeader(False, BINARY, len(cls.PIXEL_START) + len(pixels))
+        header.extend(cls.PIXEL_START)
+        return (bytes(header), pixels)
+
+    def send_pixels(self, frame):
+        """Queue a `PixelFrame`, or hold it back until the next slot if
+        the client capped its frame rate. Called on the server thread."""
         if self.connected:
-            self.sendFragmentStart(self.PIXEL_START)
-            self.sendFragmentEnd(pixels)
+            if self.frame_interval and time.monotonic() < self.next_frame:
+                if self.deferred is not None:
+                    self.skipped += 1
+                self.deferred = frame
+                self.timer = self.next_frame
+            else:
+                self._send_frame(frame)
+
+    def _send_frame(self, frame):
+        self.deferred = self.timer = None
+        if self.frame_interval:
+            self.next_frame = next_slot(self, time.monotonic())
+        # encoded by encodeLatest once the socket takes it
+        self.sendLatest(frame)
+
+
+class PixelServer(SimpleWebSocketServer):
+    """Sends the driver's latest pixel snapshot to every client when the
+    render thread calls `wakeup`"""
+
+    def __init__(self, port, driver):
+        super().__init__('', port, Client, driver=driver)
+        self.driver = driver
+
+    def handleWakeup(self):
+        self.driver._publish()
 
 
 class Server:
 
-    def __init__(self, port, **kwds):
-        self.ws_server = SimpleWebSocketServer('', port, Client, **kwds)
+    def __init__(self, port, driver):
+        self.ws_server = PixelServer(port, driver)
         self.thread = threading.Thread(target=self.target, daemon=True)
         self.thread.start()
 
     def stop(self):
         self.ws_server.close()
 
+    def wakeup(self):
+        self.ws_server.wakeup()
+
     def close(self):
         self.ws_server.close()
 
@@ -0,0 +1,24 @@
+from . driver_base import ChannelOrder
+from . spi import SPIBase
+
+
+class WS2801(SPIBase):
+    """Driver for WS2801 strips connected directly to SPI
+    on systems like the Raspberry Pi and BeagleBone.
+
+    WS2801 takes raw 3 byte pixels and latches after the clock
+    is held low for 500us, so no framing bytes are needed.
+
+    `c_order`: `ChannelOrder` instance to define color channel order
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz, WS2801 is rated up to 25MHz but 1-2MHz is more reliable
+
+    `gamma`: Gamma correction table (List of 256 values 0-255)
+
+    `transport`: Optional `spixel.drivers.transport.SPITransport` to use instead of `dev`
+    """
+
+    def __init__(self, c_order=ChannelOrder.RGB, dev="/dev/spidev0.0", SPISpeed=1, gamma=None, transport=None):
+        super().__init__(c_order=c_order, dev=dev, SPISpeed=SPISpeed, gamma=gamma, transport=transport)
@@ -0,0 +1,94 @@
+"""
+Drive one pixel buffer from several SPI buses at once.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from . driver_base import DriverBase
+from .. import log
+
+
+class _Shard(object):
+    """Stand-in for `spixel.pixels.Pixels` when setting up a shard driver,
+    which only needs the pixel count."""
+
+    def __init__(self, num):
+        self.num = num
+
+
+class ParallelSPI(DriverBase):
+    """Splits a `spixel.pixels.Pixels` buffer into consecutive shards, each
+    driven by its own SPI chipset driver on a separate spidev device.
+
+    Shards are encoded and written concurrently on a thread pool. py-spidev
+    releases the GIL during the transfer, so frame time follows the longest
+    shard instead of the sum of all of them.
+
+    `chipset`: SPI driver class, such as `spixel.drivers.APA102.APA102`
+
+    `devs`: List of SPI device paths, one per shard, e.g. `['/dev/spidev0.0', '/dev/spidev1.0']`
+
+    `transports`: List of `spixel.drivers.transport.SPITransport`, one per shard, to use instead of `devs`
+
+    `counts`: Number of pixels on each device, in the same order as `devs`.
+    If omitted the pixels are split as evenly as possible.
+
+    `**kwds`: keywords passed to every `chipset` driver, such as `c_order` or `SPISpeed`
+    """
+
+    def __init__(self, chipset, devs=None, counts=None, transports=None, **kwds):
+        super().__init__()
+        if transports is not None:
+            shards = [chipset(transport=t, **kwds) for t in transports]
+        elif devs:
+            shards = [chipset(dev=dev, **kwds) for dev in devs]
+        else:
+            raise ValueError('Either devs or transports must be given')
+        if counts is not None and len(counts) != len(shards):
+            raise ValueError('counts must have one entry per device')
+
+        self.counts = counts
+        self.shards = shards
+        """Chipset driver instance for each device"""
+        self._ranges = []
+        self._pool = None
+
+    def setup(self, pixels):
+        super().setup(pixels)
+
+        counts = self.counts
+        if counts is None:
+            size, extra = divmod(self.num, len(self.shards))
+            counts = [size + (i < extra) for i in range(len(self.shards))]
+        if sum(counts) != self.num:
+            error = 'Shard counts add up to {} but there are {} pixels'.format(sum(counts), self.num)
+            log.error(error)
+            raise ValueError(error)
+
+        self._ranges = []
+        start = 0
+        for shard, count in zip(self.shards, counts):
+            shard.setup(_Shard(count))
+            self._ranges.append((start * 3, (start + count) * 3))
+            start += count
+
+        if len(self.shards) > 1:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.shards) - 1)
+
+    def __exit__(self, type, value, traceback):
+        if self._pool is not None:
+            self._pool.shutdown()
+        for shard in self.shards:
+            shard.__exit__(type, value, traceback)
+
+    def set_master_brightness(self, brightness):
+        return all([shard.set_master_brightness(brightness) for shard in self.shards])
+
+    def _update(self, data):
+        data = memoryview(bytes(data))
+        jobs = [(shard, data[a:b]) for shard, (a, b) in zip(self.shards, self._ranges)]
+
+        # last shard runs on the calling thread while the pool handles the rest
+        futures = [self._pool.submit(shard._update, d) for shard, d in jobs[:-1]]
+        shard, d = jobs[-1]
+        shard._update(d)
+        for f in futures:
+            f.result()
@@ -3,7 +3,9 @@ from .. import log
 import sys
 import time
 import os
+import threading
 import traceback
+from collections import namedtuple
 from enum import Enum
 try:
     import serial
@@ -26,8 +28,10 @@ class Serial(DriverBase):
     foundDevices = []
     deviceIDS = {}
     deviceVers = []
+    _openPorts = set()  # ports currently opened by a Serial instance
 
-    def __init__(self, type, dev="", hardwareID="1D50:60AB", SPISpeed=2, restart_timeout=3, deviceID=None, **kwds):
+    def __init__(self, type, dev="", hardwareID="1D50:60AB", SPISpeed=2, restart_timeout=3, deviceID=None,
+                 auto_reconnect=True, reconnect_delay=0.5, reconnect_max_delay=30.0, **kwds):
         """
         Args:
             type:  LED type from `LEDTYPE`
@@ -35,6 +39,9 @@ class Serial(DriverBase):
             hardwareID: USB Vendor ID, Product ID pair (no need to change for AllPixel)
             SPISpeed: SPI speed in MHz for SPI-type LEDs
             restart_timeout: Wait time before reconnect attempt after reconfigure
+            auto_reconnect: Reconnect in the background if the device drops
+            reconnect_delay: Initial wait between reconnect attempts, doubled after each failure
+            reconnect_max_delay: Upper limit for the wait between reconnect attempts
             **kwds:  keywords passed to `spixel.drivers.driver_base.DriverBase`.
         """
         super(Serial, self).__init__(**kwds)
@@ -53,47 +60,149 @@ class Serial(DriverBase):
         self.deviceID = None
         if self.deviceID is not None and (self.deviceID < 0 or self.deviceID > 255):
             raise ValueError("deviceID must be between 0 and 255")
-        
+
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.state = CONNSTATE.DISCONNECTED
+        """Current connection state, one of `CONNSTATE`"""
+        self.dropped_frames = 0
+        """Number of frames dropped while the device was not connected"""
+        self._auto_dev = not dev
+        self._brightness = None
+        self._lock = threading.Lock()
+        # guards _pending and _brightness only, never held during I/O
+        self._cmd_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._supervisor = None
+        self._pending = {}
+        self._pad = []
+        self.link_profile = None
+        """`LinkProfile` from the last `Serial.calibrate` run, `None` if never calibrated"""
+
     def setup(self, pixels):
         super().setup(pixels)
         resp = self._connect()
         if resp == RETURN_CODES.REBOOT:  # reboot needed
             log.info(
                 "Reconfigure and reboot needed, waiting for controller to restart...")
-            self._com.close()
-            time.sleep(self.restart_timeout)
-            resp = self._connect()
-            if resp != RETURN_CODES.SUCCESS:
-                Serial._printError(resp)
-            else:
-                log.info("Reconfigure success!")
+            self._close()
+            self._start_reconnect(self.restart_timeout)
         elif resp != RETURN_CODES.SUCCESS:
             Serial._printError(resp)
+        else:
+            self.state = CONNSTATE.CONNECTED
 
-        if type in SPIChipsets:
+        if self._type in SPIChipsets:
             log.info("Using SPI Speed: %sMHz", self._SPISpeed)
 
     def __exit__(self, type, value, traceback):
+        self._stop.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
         if self._com is not None:
             log.info("Closing connection to: %s", self.dev)
+            self._close()
+
+    @property
+    def connected(self):
+        """`True` if the device is connected and accepting frames"""
+        return self.state == CONNSTATE.CONNECTED
+
+    def _close(self):
+        try:
             self._com.close()
+        except (serial.SerialException, OSError):
+            pass
+        self._com = None
+        Serial._openPorts.discard(self.dev)
+
+    def _start_reconnect(self, delay=0):
+        """Hand the connection over to the background supervisor.
+        Never blocks the caller; does nothing if a supervisor is already running.
+        """
+        if self._supervisor is not None and self._supervisor.is_alive():
+            return
+        self.state = CONNSTATE.RECONNECTING
+        self._supervisor = threading.Thread(
+            target=self._reconnect_loop, args=(delay,), daemon=True)
+        self._supervisor.start()
+
+    def _reconnect_loop(self, delay):
+        backoff = self.reconnect_delay
+        while not self._stop.wait(delay):
+            with self._lock:
+                if self._auto_dev:
+                    # device may re-enumerate on a different port
+                    self.dev = ""
+                try:
+                    resp = self._connect(rescan=self._auto_dev)
+                except (serial.SerialException, BiblioSerialError, OSError, ValueError) as e:
+                    resp = None
+                    log.debug("Reconnect to %s failed: %s", self.dev, e)
+
+                if resp == RETURN_CODES.SUCCESS:
+                    with self._cmd_lock:
+                        if self._brightness is not None:
+                            # goes out with the next frame
+                            self._queue_command(CMDTYPE.BRIGHTNESS, [self._brightness])
+                    self.state = CONNSTATE.CONNECTED
+                    log.info("Reconnected to: %s", self.dev)
+                    return
+
+                if self._com is not None:
+                    self._close()
+
+                if resp == RETURN_CODES.REBOOT:
+                    log.info("Controller rebooting, waiting to reconnect...")
+                    delay = self.restart_timeout
+                    continue
+                elif resp is not None:
+                    self.state = CONNSTATE.FAILED
+                    log.error("Reconnect to %s failed with code %s, giving up.",
+                              self.dev, resp)
+                    return
+
+            delay = backoff
+            backoff = min(backoff * 2, self.reconnect_max_delay)
+
+    def _handle_disconnect(self, error):
+        log.error("Lost connection to %s: %s", self.dev, error)
+        self._close()
+        self.state = CONNSTATE.DISCONNECTED
+        if not self.auto_reconnect:
+            raise error
+        self._start_reconnect(self.reconnect_delay)
 
     @staticmethod
     def findSerialDevices(hardwareID="1D50:60AB"):
-        hardwareID = "(?i)" + hardwareID  # forces case insensitive
         if len(Serial.foundDevices) == 0:
-            Serial.foundDevices = []
-            Serial.deviceIDS = {}
-            for port in serial.tools.list_ports.grep(hardwareID):
-                id = Serial.getDeviceID(port[0])
-                ver = Serial.getDeviceVer(port[0])
-                if id >= 0:
-                    Serial.deviceIDS[id] = port[0]
-                    Serial.foundDevices.append(port[0])
-                    Serial.deviceVers.append(ver)
+            Serial.foundDevices, Serial.deviceIDS, Serial.deviceVers = \
+                Serial._scanDevices(hardwareID)
 
         return Serial.foundDevices
 
+    @staticmethod
+    def _scanDevices(hardwareID, skip=()):
+        """Query the ID and version of every port matching `hardwareID`,
+        except the ports in `skip`.
+
+        **returns:** `(ports, {id: port}, versions)`, versions in port order
+        """
+        hardwareID = "(?i)" + hardwareID  # forces case insensitive
+        ports, ids, vers = [], {}, []
+        for port in serial.tools.list_ports.grep(hardwareID):
+            if port[0] in skip:
+                continue
+            id = Serial.getDeviceID(port[0])
+            ver = Serial.getDeviceVer(port[0])
+            if id >= 0:
+                ids[id] = port[0]
+                ports.append(port[0])
+                vers.append(ver)
+
+        return ports, ids, vers
+
     @staticmethod
     def _printError(error):
         msg = "Unknown error occured."
@@ -115,18 +224,26 @@ class Serial(DriverBase):
         log.error(error)
         raise IOError(error)
 
-    def _connect(self):
+    def _connect(self, rescan=False):
+        """Open and configure the device. With `rescan`, an auto-selected
+        device is looked up again without touching the shared device cache
+        or the ports other instances have open."""
         try:
             if(self.dev == "" or self.dev is None):
-                Serial.findSerialDevices(self._hardwareID)
+                if rescan:
+                    devices, ids, vers = Serial._scanDevices(
+                        self._hardwareID, skip=Serial._openPorts)
+                else:
+                    Serial.findSerialDevices(self._hardwareID)
+                    devices, ids, vers = Serial.foundDevices, Serial.deviceIDS, Serial.deviceVers
 
                 if self.deviceID is not None:
-                    if self.deviceID in Serial.deviceIDS:
-                        self.dev = Serial.deviceIDS[self.deviceID]
+                    if self.deviceID in ids:
+                        self.dev = ids[self.deviceID]
                         self.devVer = 0
                         try:
-                            i = Serial.foundDevices.index(self.dev)
-                            self.devVer = Serial.deviceVers[i]
+                            i = devices.index(self.dev)
+                            self.devVer = vers[i]
                         except:
                             pass
                         log.info("Using COM Port: %s, Device ID: %s, Device Ver: %s",
@@ -137,17 +254,17 @@ class Serial(DriverBase):
                             self.deviceID)
                         log.error(error)
                         raise ValueError(error)
-                elif len(Serial.foundDevices) > 0:
-                    self.dev = Serial.foundDevices[0]
+                elif len(devices) > 0:
+                    self.dev = devices[0]
                     self.devVer = 0
                     try:
-                        i = Serial.foundDevices.index(self.dev)
-                        self.devVer = Serial.deviceVers[i]
+                        i = devices.index(self.dev)
+                        self.devVer = vers[i]
                     except:
                         pass
                     devID = -1
-                    for id in Serial.deviceIDS:
-                        if Serial.deviceIDS[id] == self.dev:
+                    for id in ids:
+                        if ids[id] == self.dev:
                             devID = id
 
                     log.info("Using COM Port: %s, Device ID: %s, Device Ver: %s",
@@ -155,6 +272,7 @@ class Serial(DriverBase):
 
             try:
                 self._com = serial.Serial(self.dev, timeout=5)
+                Serial._openPorts.add(self.dev)
             except serial.SerialException as e:
                 ports = Serial.findSerialDevices(self._hardwareID)
                 error = "Invalid port specified. No COM ports available."
@@ -171,8 +289,9 @@ class Serial(DriverBase):
                 if self._type == LEDTYPE.APA102 and self.devVer >= 2:
                     pass
                 else:
-                    self._bufPad = BufferChipsets[self._type](self.numLEDs) * 3
+                    self._bufPad = BufferChipsets[self._type](self.num) * 3
                     byteCount += self._bufPad
+            self._pad = [0] * self._bufPad
 
             packet.append(byteCount & 0xFF)  # set 1st byte of byteCount
             packet.append(byteCount >> 8)  # set 2nd byte of byteCount
@@ -251,41 +370,172 @@ class Serial(DriverBase):
             log.error("Problem connecting to serial device.")
             return 0
 
+    def _queue_command(self, cmd, *data):
+        """Queue a command to go out with the next `Serial._flush_commands`.
+        A later command of the same type replaces the pending one.
+        """
+        packet = Serial._generateHeader(cmd, sum(len(d) for d in data))
+        for d in data:
+            packet.extend(d)
+        with self._cmd_lock:
+            self._pending[cmd] = packet
+
+    def _flush_commands(self):
+        """Send all pending commands in a single write and read their acks
+        back in a single read.
+        """
+        with self._cmd_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        self._com.write(b''.join(pending.values()))
+
+        resp = self._com.read(len(pending))
+        if len(resp) < len(pending):
+            Serial._comError()
+        for code in resp:
+            if code != RETURN_CODES.SUCCESS:
+                Serial._printError(code)
+
     def set_master_brightness(self, brightness):
-        """Set master brightness value for entire device"""
-        packet = Serial._generateHeader(CMDTYPE.BRIGHTNESS, 1)
-        packet.append(brightness)
-        self._com.write(packet)
-        resp = ord(self._com.read(1))
-        if resp != RETURN_CODES.SUCCESS:
-            Serial._printError(resp)
-            return False
-        else:
-            return True
+        """Set master brightness value for entire device.
+        The value is sent together with the next frame and re-sent after a reconnect.
 
-    # Push new data to strand
-    def _update(self, data):
-        count = self.buf_byte_count + self._bufPad
-        packet = Serial._generateHeader(CMDTYPE.PIXEL_DATA, count)
+        Since nothing is sent here, this always returns `True`. If the device
+        rejects the value, the `BiblioSerialError` is raised by the
+        `update` call that sends it.
+        """
+        with self._cmd_lock:
+            self._brightness = brightness
+            self._queue_command(CMDTYPE.BRIGHTNESS, [brightness])
+        return True
 
-        self.fix_data(data)
+    def calibrate(self, frames=50, apply=False):
+        """Measure the link to the device by pushing `frames` copies of the
+        current buffer and timing the write and the acknowledgement of each.
 
-        packet.extend(self._buf)
-        packet.extend([0] * self._bufPad)
-        self._com.write(packet)
+        The result is stored in `Serial.link_profile` and returned.
+        For SPI chipsets `spi_speed` is the slowest speed that still clocks a frame
+        out to the LEDs faster than it arrives over USB, so the SPI side is never
+        the bottleneck. `max_fps` is the sustainable frame rate at that speed,
+        based on the 90th percentile frame time.
 
-        resp = self._com.read(1)
-        if len(resp) == 0:
-            Serial._comError()
-        if ord(resp) != RETURN_CODES.SUCCESS:
-            Serial._printError(ord(resp))
+        `frames (int)`: Number of test frames to send
 
-        self._com.flushInput()
+        `apply (bool)`: If `True` and the recommended SPI speed differs from the
+        current one, reconfigure the device. The reconnect runs in the background.
+        """
+        if frames < 1:
+            raise ValueError("frames must be at least 1, got {}".format(frames))
+
+        with self._lock:
+            if not self.connected:
+                raise BiblioSerialError("Device must be connected to calibrate.")
+
+            self.fix_data(self.pixels.buffer)
+            packet = Serial._generateHeader(CMDTYPE.PIXEL_DATA, self.buf_byte_count + self._bufPad)
+            packet.extend(self._buf)
+            packet.extend(self._pad)
+
+            write_times = []
+            ack_times = []
+            for _ in range(frames):
+                start = time.perf_counter()
+                self._com.write(packet)
+                self._com.flush()
+                written = time.perf_counter()
+                resp = self._com.read(1)
+                done = time.perf_counter()
+                if len(resp) == 0:
+                    Serial._comError()
+                if ord(resp) != RETURN_CODES.SUCCESS:
+                    Serial._printError(ord(resp))
+                write_times.append(written - start)
+                ack_times.append(done - written)
+            self._com.flushInput()
+
+        write_time = _percentile(write_times, 50)
+        ack_latency = _percentile(ack_times, 50)
+        frame_time = _percentile([w + a for w, a in zip(write_times, ack_times)], 90)
+
+        spi_speed = self._SPISpeed
+        if self._type in SPIChipsets and write_time > 0:
+            bits = len(packet) * 8
+            spi_speed = min(24, max(1, int(bits / write_time / 1000000.0) + 1))
+            # the ack includes clocking the frame out at the current speed
+            frame_time = max(write_time, frame_time + bits / (spi_speed * 1000000.0) -
+                             bits / (self._SPISpeed * 1000000.0))
+
+        self.link_profile = LinkProfile(
+            led_type=self._type,
+            num=self.num,
+            frame_bytes=len(packet),
+            write_time=write_time,
+            ack_latency=ack_latency,
+            throughput=len(packet) / write_time if write_time > 0 else 0,
+            spi_speed=spi_speed,
+            max_fps=1.0 / frame_time if frame_time > 0 else 0)
+
+        log.info("Link: %.0f B/s, ack %.2fms, SPI %sMHz, max %.1f FPS",
+                 self.link_profile.throughput, ack_latency * 1000.0,
+                 spi_speed, self.link_profile.max_fps)
+
+        if apply and spi_speed != self._SPISpeed:
+            log.info("Reconfiguring SPI Speed: %sMHz", spi_speed)
+            self._SPISpeed = spi_speed
+            with self._lock:
+                self._close()
+                self._start_reconnect()
+
+        return self.link_profile
+
+    # Push new data to strand
+    def _update(self, data):
+        # never wait on the supervisor, just drop the frame
+        if not self._lock.acquire(blocking=False):
+            self.dropped_frames += 1
+            return
+        try:
+            if not self.connected:
+                self.dropped_frames += 1
+                return
+
+            self.fix_data(data)
+            self._queue_command(CMDTYPE.PIXEL_DATA, self._buf, self._pad)
+            self._flush_commands()
+
+            self._com.flushInput()
+        except (serial.SerialException, OSError) as e:
+            self.dropped_frames += 1
+            self._handle_disconnect(e)
+        finally:
+            self._lock.release()
 
 
 class BiblioSerialError(Exception):
     pass
 
+
+LinkProfile = namedtuple('LinkProfile', [
+    'led_type', 'num', 'frame_bytes', 'write_time', 'ack_latency',
+    'throughput', 'spi_speed', 'max_fps'])
+LinkProfile.__doc__ = """Measured link characteristics returned by `Serial.calibrate`.
+Times are in seconds, `throughput` in bytes per second and `spi_speed` in MHz."""
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+
+class CONNSTATE:
+    """Enumeration of `Serial.state` values"""
+    DISCONNECTED = 0  # Link lost, reconnect not yet started
+    RECONNECTING = 1  # Background supervisor is trying to reconnect
+    CONNECTED = 2  # Frames are being sent
+    FAILED = 3  # Device refused configuration, no further attempts
+
 class LEDTYPE:
     """Enumeration of valid LED types"""
     GENERIC = 0  # Use if the serial device only supports one chipset
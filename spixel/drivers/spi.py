@@ -0,0 +1,108 @@
+"""
+Shared base for drivers talking directly to SPI LED chipsets.
+"""
+from . driver_base import DriverBase, ChannelOrder
+from . transport import SpiDevTransport
+
+
+class SPIBase(DriverBase):
+    """Base driver for chipsets connected directly to the SPI bus
+    on systems like the Raspberry Pi and BeagleBone.
+
+    Frames are held in a preallocated `bytearray` laid out as
+    `[start frame][pixel 0][pixel 1]...[end frame]`. Derived drivers describe
+    the chipset framing and `SPIBase.compile` turns it into per-channel lookup
+    tables, so encoding a frame is a few `bytes.translate` and slice
+    assignments followed by one write to the transport.
+
+    `c_order`: `ChannelOrder` instance to define color channel order
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz
+
+    `gamma`: Gamma correction table (List of 256 values 0-255)
+
+    `transport`: `spixel.drivers.transport.SPITransport` to write to instead of
+    opening `dev`, e.g. `spixel.drivers.transport.MemoryTransport` for testing
+    """
+
+    pixel_bytes = 3
+    """Bytes per pixel on the wire"""
+    channel_offset = 0
+    """Offset of the first color byte within each pixel, for chipsets with a per-pixel header byte"""
+
+    def __init__(self, c_order=ChannelOrder.RGB, dev="/dev/spidev0.0", SPISpeed=12, gamma=None, transport=None):
+        super().__init__(c_order=c_order, gamma=gamma)
+
+        self.dev = dev
+        if transport is None:
+            transport = SpiDevTransport(dev, SPISpeed)
+        self.transport = transport
+        """`spixel.drivers.transport.SPITransport` frames are written to"""
+
+        self._packet = bytearray()
+        self._luts = None
+        self._single_lut = None
+
+    def setup(self, pixels):
+        super().setup(pixels)
+
+        start = self._start_frame_bytes()
+        end = self._end_frame_bytes()
+        self._start_frame = len(start)
+        self._pixel_stop = self._start_frame + self.num * self.pixel_bytes
+        self._packet = bytearray(start + bytes(self._pixel_stop - self._start_frame) + end)
+        self.compile()
+
+    def _start_frame_bytes(self):
+        """Bytes sent before the pixel data. Override per chipset."""
+        return b''
+
+    def _end_frame_bytes(self):
+        """Bytes sent after the pixel data (latch). Override per chipset."""
+        return b''
+
+    def _channel_value(self, value, channel):
+        """Wire value for gamma corrected `value` in output slot `channel`. Override per chipset."""
+        return value
+
+    def compile(self):
+        """Build the per-channel lookup tables from `gamma` and the chipset encoding.
+        Call again after changing `gamma`.
+        """
+        self._luts = [bytes(self._channel_value(self.gamma[v], a) for v in range(256))
+                      for a in range(3)]
+        # raw RGB chipsets can translate the whole buffer in one pass
+        self._single_lut = None
+        if (self.pixel_bytes == 3 and list(self.c_order) == ChannelOrder.RGB and
+                self._luts[0] == self._luts[1] == self._luts[2]):
+            self._single_lut = self._luts[0]
+
+    def _encode_header(self, data):
+        """Fill per-pixel header bytes, for chipsets with a `channel_offset`."""
+        pass
+
+    def fix_data(self, data):
+        data = bytes(data)
+        packet = self._packet
+        start = self._start_frame
+        stop = self._pixel_stop
+        if self._single_lut is not None:
+            packet[start:stop] = data.translate(self._single_lut)
+        else:
+            step = self.pixel_bytes
+            start += self.channel_offset
+            for a, b in enumerate(self.c_order):
+                packet[start + a:stop:step] = data[b::3].translate(self._luts[a])
+        self._encode_header(data)
+
+    def __exit__(self, type, value, traceback):
+        self.transport.close()
+
+    def _sendData(self):
+        self.transport.write(self._packet)
+
+    def _update(self, data):
+        self.fix_data(data)
+        self._sendData()
@@ -0,0 +1,148 @@
+"""
+Byte transports used by `spixel.drivers.spi.SPIBase` drivers.
+
+`SpiDevTransport` writes to real hardware through py-spidev.
+`MemoryTransport` records the bytes instead, so SPI drivers can be
+created, profiled and regression tested on machines without an SPI bus.
+"""
+import time
+from collections import deque
+from .. import log
+
+# Default spidev bufsiz, largest single transfer the kernel accepts
+SPI_CHUNK_SIZE = 4096
+
+
+class SPITransport(object):
+    """Base class for SPI transports. Derived classes must implement `write`."""
+
+    def write(self, data):
+        """Send one complete frame. `data` is any bytes-like object."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the underlying device"""
+        pass
+
+
+class SpiDevTransport(SPITransport):
+    """Writes to `/dev/spidev*.*` through py-spidev, split into chunks
+    no larger than the kernel's spidev bufsiz.
+
+    `dev`: SPI device path in the format `/dev/spidev*.*`
+
+    `SPISpeed`: SPI clock speed in MHz
+    """
+
+    def __init__(self, dev="/dev/spidev0.0", SPISpeed=12):
+        self.dev = dev
+
+        a, b = -1, -1
+        d = self.dev.replace("/dev/spidev", "")
+        s = d.split('.')
+        if len(s) == 2:
+            a = int(s[0])
+            b = int(s[1])
+
+        if a < 0 or b < 0:
+            error = "When using py-spidev, the given device must be in the format /dev/spidev*.*"
+            log.error(error)
+            raise ValueError(error)
+
+        self._bootstrapSPIDev()
+        import spidev
+        self.spi = spidev.SpiDev()
+        self.spi.open(a, b)
+        self.spi.max_speed_hz = int(SPISpeed * 1000000.0)
+        log.info('py-spidev speed @ %.1f MHz',
+                 (float(self.spi.max_speed_hz) / 1000000.0))
+
+        self._chunk_size = self._spiChunkSize()
+
+    def _bootstrapSPIDev(self):
+        import os.path
+        try:
+            import spidev
+        except:
+            error = "Unable to import spidev. Please install. pip install spidev"
+            log.error(error)
+            raise ImportError(error)
+
+        if not os.path.exists(self.dev):
+            error = "Cannot find SPI device. Please see https://github.com/maniacallabs/bibliopixel/wiki/SPI-Setup for details."
+            log.error(error)
+            raise IOError(error)
+
+        # permissions check
+        try:
+            open(self.dev)
+        except IOError as e:
+            if e.errno == 13:
+                error = "Cannot find SPI device. Please see https://github.com/maniacallabs/bibliopixel/wiki/SPI-Setup for details."
+                log.error(error)
+                raise IOError(error)
+            else:
+                raise e
+
+    @staticmethod
+    def _spiChunkSize():
+        """Largest transfer the spidev kernel module accepts"""
+        try:
+            with open('/sys/module/spidev/parameters/bufsiz') as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return SPI_CHUNK_SIZE
+
+    def write(self, data):
+        if hasattr(self.spi, 'writebytes2'):
+            # takes any buffer and splits it into bufsiz transfers itself
+            self.spi.writebytes2(data)
+        else:
+            data = memoryview(data)
+            for i in range(0, len(data), self._chunk_size):
+                self.spi.writebytes(list(data[i:i + self._chunk_size]))
+
+    def close(self):
+        self.spi.close()
+
+
+class MemoryTransport(SPITransport):
+    """Records frames instead of sending them anywhere.
+
+    `SPISpeed`: If set, each write sleeps for as long as the frame would take
+    on a bus clocked at this many MHz
+
+    `path`: If set, every frame is also appended to this file as raw bytes
+
+    `keep (int)`: Number of recent frames to keep in `MemoryTransport.frames`, `None` for all
+    """
+
+    def __init__(self, SPISpeed=None, path=None, keep=1):
+        self.speed_hz = SPISpeed * 1000000.0 if SPISpeed else None
+        self.frames = deque(maxlen=keep)
+        """Most recently written frames as `bytes`"""
+        self.writes = 0
+        """Total number of frames written"""
+        self.bytes_written = 0
+        """Total number of bytes written"""
+        self._file = open(path, 'ab') if path else None
+
+    @property
+    def last(self):
+        """Last frame written, `None` if nothing was written yet"""
+        return self.frames[-1] if self.frames else None
+
+    def write(self, data):
+        data = bytes(data)
+        self.frames.append(data)
+        self.writes += 1
+        self.bytes_written += len(data)
+        if self._file is not None:
+            self._file.write(data)
+        if self.speed_hz:
+            time.sleep(len(data) * 8 / self.speed_hz)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,183 @@
+"""
+Named layers drawn separately and composited onto a `spixel.matrix.Matrix`.
+"""
+
+import sys
+from . drivers.driver_base import DriverBase
+from . matrix import Matrix, _blend_tables, _add_bytes
+
+
+class BLEND:
+    """Layer blend mode enumeration. Use with `Layer.mode`."""
+    NORMAL = 'normal'
+    """Layer replaces what is below"""
+    ADD = 'add'
+    """Channels are added, saturating at 255"""
+    SCREEN = 'screen'
+    """Screen blend, as in `spixel.colors.blend`"""
+    MULTIPLY = 'multiply'
+    """Channels are multiplied, darkening what is below"""
+
+
+_BLEND_FUNCS = {
+    BLEND.ADD: lambda a, b: min(a + b, 255),
+    BLEND.SCREEN: lambda a, b: 255 - (((255 - a) * (255 - b)) >> 8),
+    BLEND.MULTIPLY: lambda a, b: a * b // 255,
+}
+_blend_luts = {}
+
+# per pixel OR of the channels to a byte mask, 0xFF for any lit pixel
+_LIT = bytes([0] + [255] * 255)
+
+
+def _blend_lut(mode):
+    """65536 entry table of blended bytes, indexed by `below << 8 | above`"""
+    lut = _blend_luts.get(mode)
+    if lut is None:
+        func = _BLEND_FUNCS[mode]
+        lut = _blend_luts[mode] = bytes([func(a, b) for a in range(256) for b in range(256)])
+    return lut
+
+
+def _lit_mask(data):
+    """Big integer with 0xFF bytes for the channels of all pixels of `data` that are not black"""
+    lit = (int.from_bytes(data[0::3], 'big') |
+           int.from_bytes(data[1::3], 'big') |
+           int.from_bytes(data[2::3], 'big'))
+    lit = lit.to_bytes(len(data) // 3, 'big').translate(_LIT)
+    mask = bytearray(len(data))
+    mask[0::3] = mask[1::3] = mask[2::3] = lit
+    return int.from_bytes(mask, 'big')
+
+
+def blend_bytes(below, above, mode=BLEND.NORMAL, opacity=255):
+    """Blend two equally long `R,G,B` byte strings. Black pixels of `above` are
+    transparent and leave `below` unchanged.
+
+    `mode`: One of `BLEND`
+
+    `opacity (int)`: 0-255 opacity of `above`
+
+    **returns:** blended `bytes`
+    """
+    mask = _lit_mask(above)
+    if not mask or opacity <= 0:
+        return below
+
+    if mode == BLEND.NORMAL:
+        out = above
+    else:
+        index = bytearray(len(above) * 2)
+        lo, hi = (0, 1) if sys.byteorder == 'little' else (1, 0)
+        index[lo::2] = above
+        index[hi::2] = below
+        out = bytes(map(_blend_lut(mode).__getitem__, memoryview(index).cast('H')))
+
+    if opacity < 255:
+        above_t, below_t = _blend_tables(opacity)
+        out = _add_bytes(out.translate(above_t), below.translate(below_t))
+
+    out = (int.from_bytes(out, 'big') & mask) | (int.from_bytes(below, 'big') & ~mask)
+    return out.to_bytes(len(above), 'big')
+
+
+class Layer(Matrix):
+    """One layer of `Layers`, a `spixel.matrix.Matrix` with a plain row-major
+    buffer that supports all the usual drawing functions. Black pixels are
+    transparent.
+
+    `width (int)`: X axis dimension of layer
+
+    `height (int)`: Y axis dimension of layer
+
+    `z (int)`: Stacking order, higher is drawn on top
+
+    `opacity (int)`: 0-255 opacity of the whole layer
+
+    `mode`: Blend mode, one of `BLEND`
+    """
+
+    def __init__(self, width, height, z=0, opacity=255, mode=BLEND.NORMAL):
+        super().__init__(DriverBase(), width, height)
+        self.z = z
+        self.opacity = opacity
+        self.mode = mode
+        self.visible = True
+        """Hidden layers are left out of the composite"""
+
+
+class Layers(object):
+    """Composites named `Layer` objects onto `matrix`, lowest `Layer.z` first.
+
+    The composite of every prefix of the layer stack is cached. When a layer
+    changes, only it and the layers above it are blended again, so a
+    static background under a scrolling text layer costs nothing per frame.
+
+        layers = Layers(matrix)
+        bg = layers.add('bg')
+        text = layers.add('text', z=1, mode=BLEND.SCREEN)
+        bg.draw_rect_filled(0, 0, matrix.width, matrix.height, colors.Blue)
+        text.draw_text('Hi', color=colors.Red)
+        layers.update()
+
+    `matrix`: `spixel.matrix.Matrix` to composite onto
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.layers = {}
+        """Dict of name to `Layer`"""
+        self._order = 0
+        self._cache = []
+
+    def add(self, name, z=0, opacity=255, mode=BLEND.NORMAL):
+        """Add and return a new `Layer` the size of the matrix.
+        Layers with the same `z` stack in the order they were added."""
+        if name in self.layers:
+            raise ValueError('Layer {} already exists'.format(name))
+        layer = Layer(self.matrix.width, self.matrix.height, z, opacity, mode)
+        layer._order = self._order
+        self._order += 1
+        self.layers[name] = layer
+        return layer
+
+    def remove(self, name):
+        """Remove the layer called `name`"""
+        del self.layers[name]
+
+    def __getitem__(self, name):
+        return self.layers[name]
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def __iter__(self):
+        """Visible layers, bottom to top"""
+        layers = [layer for layer in self.layers.values() if layer.visible]
+        return iter(sorted(layers, key=lambda layer: (layer.z, layer._order)))
+
+    def composite(self):
+        """Blend all visible layers and write the result into the matrix buffer.
+
+        **returns:** composite as row-major `R,G,B` bytes
+        """
+        out = bytes(self.matrix.width * self.matrix.height * 3)
+        cache = []
+        reuse = True
+        for i, layer in enumerate(self):
+            state = (layer, bytes(layer.buffer), layer.opacity, layer.mode)
+            reuse = reuse and i < len(self._cache) and self._cache[i][0] == state
+            if reuse:
+                out = self._cache[i][1]
+            else:
+                out = blend_bytes(out, state[1], layer.mode, layer.opacity)
+            cache.append((state, out))
+        self._cache = cache
+
+        self.matrix.blit(out, 0, 0, w=self.matrix.width)
+        return out
+
+    def update(self):
+        """Composite the layers and update the matrix"""
+        self.composite()
+        self.matrix.update()
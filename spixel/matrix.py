@@ -3,10 +3,14 @@
 """
 
 import math
+from array import array
 from . import colors
 from . import font
 from . pixels import Pixels
 
+AA_SAMPLES = 4
+"""Sub-scanlines per pixel row used for anti-aliased polygon edges"""
+
 
 def rotate_and_flip(coord_map, rotation, flip):
     rotation = (-rotation % 360) // 90
@@ -46,6 +50,68 @@ def make_matrix_coord_map(width, height, serpentine=False, offset=0, rotation=0,
     return result
 
 
+def _polygon_edges(points):
+    """Non-horizontal edges of the closed polygon `points` as
+    `(y_top, y_bottom, x_at_top, dx_per_y)` tuples"""
+    edges = []
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        if y0 == y1:
+            continue
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        edges.append((y0, y1, x0, (x1 - x0) / (y1 - y0)))
+    return edges
+
+
+def _crossings(edges, y):
+    """Sorted x positions where the scanline at `y` crosses `edges`.
+    Edges include their top and exclude their bottom, so shared vertices count once."""
+    return sorted([x + (y - y0) * dx for y0, y1, x, dx in edges if y0 <= y < y1])
+
+
+def _image_source(src, w):
+    """`(data, width, height)` of a `Matrix.blit` source, data as row-major `R,G,B` bytes"""
+    if isinstance(src, Matrix):
+        return src.to_bytes(), src.width, src.height
+    if hasattr(src, 'shape') and hasattr(src, 'tobytes'):
+        if len(src.shape) != 3 or src.shape[2] not in (3, 4):
+            raise ValueError('Arrays must have shape (height, width, 3) or (height, width, 4), '
+                             'got {}'.format(tuple(src.shape)))
+        if src.shape[2] == 4:
+            src = src[:, :, :3]  # alpha is ignored, use the alpha or key_color arguments
+        if str(src.dtype) != 'uint8':
+            src = src.astype('uint8')
+        h, w = src.shape[:2]
+        return src.tobytes(), w, h
+    if not w:
+        raise ValueError('Width w is required for raw byte sources')
+    data = bytes(src)
+    return data, w, len(data) // (w * 3)
+
+
+def _key_mask(data, key_color):
+    """One byte per pixel of `data`, 1 where the pixel equals `key_color`"""
+    mask = -1
+    for c, v in enumerate(key_color):
+        table = bytearray(256)
+        table[v] = 1
+        mask &= int.from_bytes(data[c::3].translate(table), 'big')
+    return mask.to_bytes(len(data) // 3, 'big')
+
+
+def _blend_tables(alpha):
+    """Translate tables scaling source and destination bytes by `alpha`,
+    chosen so each pair of scaled bytes adds up to at most 255"""
+    return (bytes([v * alpha // 255 for v in range(256)]),
+            bytes([v * (255 - alpha) // 255 for v in range(256)]))
+
+
+def _add_bytes(a, b):
+    """Bytewise sum of `a` and `b`, which must not exceed 255 for any byte,
+    as one big integer addition"""
+    return (int.from_bytes(a, 'big') + int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
 class Matrix(Pixels):
     """2D Matrix abstraction wrapper around `spixel.pixels.Pixels`
     to provide `(X,Y)` coordinate mapping. Internally the data is stored as
@@ -58,28 +124,205 @@ class Matrix(Pixels):
 
     `height (int)`: Y axis dimension of matrix
 
-    `coord_map`: 2D matrix mapping `(X,Y)` coordinates to 1D indicies. Will be auto-generated with best-guess if omitted.
+    `coord_map`: 2D matrix mapping `(X,Y)` coordinates to 1D indicies as `coord_map[y][x]`.
+    Will be auto-generated with best-guess if omitted.
     """
     def __init__(self, driver, width, height, serpentine=False, rotation=0, y_flip=False, coord_map=None):
         if not coord_map:
             coord_map = make_matrix_coord_map(width, height, serpentine, 0, rotation, y_flip)
         self.map = coord_map
         """Current coordinate map object"""
+        self.offsets = None
+        """Flat `array('I')` holding the `Matrix.buffer` offset of the pixel at
+        `(x, y)` in `offsets[y * width + x]`. Built by `Matrix.compile`."""
 
         super().__init__(driver, width * height)
 
-        self.width = len(self.map)
+        self.width = None
         """X axis dimension of matrix, for querying in animation code"""
         self.height = None
-        """X axis dimension of matrix, for querying in animation code"""
+        """Y axis dimension of matrix, for querying in animation code"""
+
+        self.compile()
+
+    def compile(self):
+        """Rebuild `Matrix.offsets`, `Matrix.width` and `Matrix.height` from `Matrix.map`.
+        Call again after changing the map."""
+        self.height = len(self.map)
+        self.width = len(self.map[0]) if self.map else 0
+        for row in self.map:
+            if len(row) != self.width:
+                raise ValueError('All rows of coords must be the same length!')
+        self.offsets = array('I', [i * 3 for row in self.map for i in row])
+
+        w = self.width
+        self._row_strides = [self._stride(self.offsets[y * w:(y + 1) * w]) for y in range(self.height)]
+        self._col_strides = [self._stride(self.offsets[x::w]) for x in range(w)]
+
+    @staticmethod
+    def _stride(offsets):
+        """Constant distance between consecutive `offsets`, `None` if there is none"""
+        if len(offsets) < 2:
+            return 3
+        step = offsets[1] - offsets[0]
+        if step and offsets.tolist() == list(range(offsets[0], offsets[0] + step * len(offsets), step)):
+            return step
+        return None
+
+    def _fill_run(self, index, step, count, stride, color):
+        """Set `count` pixels starting at `offsets[index]`, `step` apart in
+        `Matrix.offsets`, whose buffer offsets are `stride` apart."""
+        buf = self.buffer
+        if stride is None:
+            for i in self.offsets[index:index + step * count:step]:
+                buf[i:i + 3] = color
+            return
 
-        for col in self.map:
-            y = len(col)
-            if self.height is None:
-                self.height = y
-            else:
-                if y != self.height:
-                    raise ValueError('All columns of coords must be the same length!')
+        first = self.offsets[index]
+        if stride == 3:
+            buf[first:first + 3 * count] = tuple(color) * count
+        elif stride == -3:
+            buf[first - 3 * (count - 1):first + 3] = tuple(color) * count
+        else:
+            for c in range(3):
+                stop = first + c + stride * count
+                buf[first + c:stop if stop >= 0 else None:stride] = [color[c]] * count
+
+    def _read_run(self, index, step, count, stride):
+        """Pixels of a run, see `Matrix._fill_run`, as `R,G,B` bytes"""
+        buf = self.buffer
+        if stride is None:
+            out = bytearray()
+            for i in self.offsets[index:index + step * count:step]:
+                out.extend(buf[i:i + 3])
+            return bytes(out)
+
+        first = self.offsets[index]
+        if stride == 3:
+            return bytes(buf[first:first + 3 * count])
+        out = bytearray(3 * count)
+        for c in range(3):
+            stop = first + c + stride * count
+            out[c::3] = buf[first + c:stop if stop >= 0 else None:stride]
+        return bytes(out)
+
+    def _write_run(self, index, step, count, stride, data):
+        """Set the pixels of a run, see `Matrix._fill_run`, from `R,G,B` bytes"""
+        buf = self.buffer
+        if stride is None:
+            for k, i in enumerate(self.offsets[index:index + step * count:step]):
+                buf[i:i + 3] = data[k * 3:k * 3 + 3]
+            return
+
+        first = self.offsets[index]
+        if stride == 3:
+            buf[first:first + 3 * count] = data
+        else:
+            for c in range(3):
+                stop = first + c + stride * count
+                buf[first + c:stop if stop >= 0 else None:stride] = data[c::3]
+
+    def to_bytes(self):
+        """Returns all pixels as row-major `R,G,B` bytes, `width * height * 3` long,
+        independent of the coordinate map"""
+        w = self.width
+        return b''.join([self._read_run(y * w, 1, w, self._row_strides[y]) for y in range(self.height)])
+
+    def blit(self, src, x=0, y=0, alpha=None, key_color=None, w=None):
+        """Draw image `src` with its top-left corner at `(x,y)`, clipped to the matrix.
+
+        `src`: Another `Matrix`, a NumPy `uint8` array of shape `(height, width, 3)`
+        or `(height, width, 4)` with the alpha channel ignored, or raw row-major `R,G,B` bytes
+
+        `alpha (int)`: 0-255 opacity to blend `src` with, `None` to copy it as is
+
+        `key_color (tuple)`: `(R,G,B)` color of `src` pixels to leave out as transparent
+
+        `w (int)`: Width of `src`, required for raw bytes
+        """
+        data, sw, sh = _image_source(src, w)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + sw, self.width), min(y + sh, self.height)
+        if x0 >= x1 or y0 >= y1 or alpha == 0:
+            return
+
+        count = x1 - x0
+        mask = None if key_color is None else _key_mask(data, key_color)
+        tables = None if alpha is None or alpha >= 255 else _blend_tables(alpha)
+
+        for row in range(y0, y1):
+            start = (row - y) * sw + x0 - x
+            seg = data[start * 3:(start + count) * 3]
+            index, stride = row * self.width + x0, self._row_strides[row]
+            if tables is not None:
+                dst = self._read_run(index, 1, count, stride)
+                seg = _add_bytes(seg.translate(tables[0]), dst.translate(tables[1]))
+
+            if mask is None:
+                self._write_run(index, 1, count, stride, seg)
+                continue
+            # copy each run of opaque pixels
+            m = mask[start:start + count]
+            i = m.find(0)
+            while i >= 0:
+                j = m.find(1, i)
+                if j < 0:
+                    j = count
+                self._write_run(index + i, 1, j - i, stride, seg[i * 3:j * 3])
+                i = m.find(0, j)
+
+    def scroll(self, dx, dy, wrap=False, fill=None):
+        """Move the whole image `dx` pixels right and `dy` pixels down.
+        Negative values move it left and up.
+
+        `wrap (bool)`: If `True` pixels moved off one edge come back in on the opposite one
+
+        `fill (tuple)`: `(R,G,B)` color for vacated pixels when not wrapping, off if omitted
+        """
+        w, h = self.width, self.height
+        if not w or not h:
+            return
+        row_bytes = w * 3
+        data = self.to_bytes()
+        rows = [data[y * row_bytes:(y + 1) * row_bytes] for y in range(h)]
+        fill = bytes(fill or (0, 0, 0))
+
+        if wrap:
+            k = dy % h
+            if k:
+                rows = rows[-k:] + rows[:-k]
+            k = (dx % w) * 3
+            if k:
+                rows = [r[-k:] + r[:-k] for r in rows]
+        else:
+            k = min(abs(dy), h)
+            if k:
+                blank = [fill * w] * k
+                rows = blank + rows[:h - k] if dy > 0 else rows[k:] + blank
+            k = min(abs(dx), w)
+            if k:
+                pad = fill * k
+                if dx > 0:
+                    rows = [pad + r[:row_bytes - k * 3] for r in rows]
+                else:
+                    rows = [r[k * 3:] + pad for r in rows]
+
+        self.blit(b''.join(rows), 0, 0, w=w)
+
+    def _fill_rect(self, x, y, w, h, color):
+        """Fill a rectangle, clipped once, by rows or by columns depending on
+        which are laid out with a constant stride"""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        width = self.width
+        if None in self._row_strides[y0:y1] and None not in self._col_strides[x0:x1]:
+            for col in range(x0, x1):
+                self._fill_run(y0 * width + col, width, y1 - y0, self._col_strides[col], color)
+        else:
+            for row in range(y0, y1):
+                self._fill_run(row * width + x0, 1, x1 - x0, self._row_strides[row], color)
 
     def _get_pixel_positions(self):
         """**Internal Use**: Returns pixel_positions object for `spixel.drivers.SimPixel.driver.SimPixel`"""
@@ -100,10 +343,9 @@ class Matrix(Pixels):
 
         `color (tuple)`: `(R,G,B)` color tuple or named value from `spixel.colors`
         """
-        if x < 0 or x >= self.width or y < 0 or y >= self.height:
-            return
-        i = self.map[y][x]
-        super().set(i, color)
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = self.offsets[y * self.width + x]
+            self.buffer[i:i + 3] = color
 
     def get(self, x, y):
         """Get pixel color tuple at given `(X,Y)` coordinate. Can also use the format `c = matrix[x, y]` instead of calling function.
@@ -112,10 +354,12 @@ class Matrix(Pixels):
 
         `y (int)`: Y coordinate of pixel to get
 
-        **returns:** `(R,G,B)` color tuple
+        **returns:** `(R,G,B)` color tuple, `(0, 0, 0)` if out of bounds
         """
-        i = self.map[y][x]
-        return self.get(i)
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = self.offsets[y * self.width + x]
+            return tuple(self.buffer[i:i + 3])
+        return 0, 0, 0
 
     def __setitem__(self, pixel, color):
         x, y = pixel
@@ -345,11 +589,18 @@ class Matrix(Pixels):
                 plot(x, ipart(intery) + 1, fpart(intery))
             intery = intery + gradient
 
+    # axis aligned spans cover whole pixels, so aa has no effect on them
     def _draw_fast_vline(self, x, y, h, color=None, aa=False):
-        self.draw_line(x, y, x, y + h - 1, color, aa)
+        if 0 <= x < self.width:
+            y0, y1 = max(y, 0), min(y + h, self.height)
+            if y0 < y1:
+                self._fill_run(y0 * self.width + x, self.width, y1 - y0, self._col_strides[x], color)
 
     def _draw_fast_hline(self, x, y, w, color=None, aa=False):
-        self.draw_line(x, y, x + w - 1, y, color, aa)
+        if 0 <= y < self.height:
+            x0, x1 = max(x, 0), min(x + w, self.width)
+            if x0 < x1:
+                self._fill_run(y * self.width + x0, 1, x1 - x0, self._row_strides[y], color)
 
     def draw_rect(self, x, y, w, h, color=None):
         """Draw rectangle with top-left corner at `(x,y)`, width `w` and height `h` with specified `color` tuple"""
@@ -360,8 +611,7 @@ class Matrix(Pixels):
 
     def draw_rect_filled(self, x, y, w, h, color=None, aa=False):
         """Draw rectangle with top-left corner at `(x,y)`, width `w` and height `h` with specified `color` tuple"""
-        for i in range(x, x + w):
-            self._draw_fast_vline(i, y, h, color, aa)
+        self._fill_rect(x, y, w, h, color)
 
     def draw_round_rect(self, x, y, w, h, r, color=None, aa=False):
         """Draw rectangle with top-left corner at `(x,y)`, width `w`, height `h` and corner radius `r` with specified `color` tuple"""
@@ -391,6 +641,86 @@ class Matrix(Pixels):
         self.draw_line(x1, y1, x2, y2, color, None, aa)
         self.draw_line(x2, y2, x0, y0, color, None, aa)
 
+    def draw_triangle_filled(self, x0, y0, x1, y1, x2, y2, color=None, aa=False):
+        """Draw filled triangle with points `(x0,y0)`, `(x1,y1)`, and `(x2,y2)` and specified `color` tuple.
+
+        `aa (bool)`: If `True` blend anti-aliased edges into the existing pixels
+        """
+        self.draw_polygon_filled([(x0, y0), (x1, y1), (x2, y2)], color, aa)
+
+    def draw_polygon_filled(self, points, color=None, aa=False):
+        """Draw filled polygon with corners `points`, a list of `(x,y)` tuples, and specified `color` tuple.
+        Self-intersecting polygons are filled with the even-odd rule.
+
+        `aa (bool)`: If `True` blend anti-aliased edges into the existing pixels,
+        otherwise the fill covers the same pixels as the outline drawn by `Matrix.draw_line`
+        """
+        points = list(points)
+        if len(points) < 3:
+            return
+        edges = _polygon_edges(points)
+        if aa:
+            self._fill_polygon_aa(points, edges, color)
+            return
+
+        ys = [p[1] for p in points]
+        for y in range(max(math.ceil(min(ys)), 0), min(math.floor(max(ys)), self.height - 1) + 1):
+            xs = _crossings(edges, y)
+            for a, b in zip(xs[::2], xs[1::2]):
+                a, b = math.ceil(a), math.floor(b)
+                if a <= b:
+                    self._draw_fast_hline(a, y, b - a + 1, color)
+
+        points = [(int(round(x)), int(round(y))) for x, y in points]
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            self._draw_bresenham_line(x0, y0, x1, y1, color)
+
+    def _fill_polygon_aa(self, points, edges, color):
+        # pixel x covers [x - 0.5, x + 0.5), shifted by 0.5 below so it covers [x, x + 1)
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        left = max(math.floor(min(xs) + 0.5), 0)
+        right = min(math.floor(max(xs) + 0.5) + 1, self.width)
+        if left >= right:
+            return
+        weight = 1.0 / AA_SAMPLES
+
+        for y in range(max(math.floor(min(ys) + 0.5), 0), min(math.floor(max(ys) + 0.5) + 1, self.height)):
+            # partial coverage per pixel plus a difference array of fully covered runs
+            part = [0.0] * (right - left + 1)
+            full = [0.0] * (right - left + 1)
+            for k in range(AA_SAMPLES):
+                crossings = _crossings(edges, y - 0.5 + (k + 0.5) * weight)
+                for a, b in zip(crossings[::2], crossings[1::2]):
+                    a, b = max(a + 0.5, left), min(b + 0.5, right)
+                    if a >= b:
+                        continue
+                    ia, ib = int(a), int(b)
+                    if ia == ib:
+                        part[ia - left] += (b - a) * weight
+                    else:
+                        part[ia - left] += (ia + 1 - a) * weight
+                        part[ib - left] += (b - ib) * weight
+                        full[ia + 1 - left] += weight
+                        full[ib - left] -= weight
+
+            covered = 0.0
+            run = None
+            for i in range(right - left + 1):
+                covered += full[i]
+                level = covered + part[i]
+                if level >= 0.999 and i < right - left:
+                    if run is None:
+                        run = i
+                    continue
+                if run is not None:
+                    self._draw_fast_hline(left + run, y, i - run, color)
+                    run = None
+                if level > 0.001 and i < right - left:
+                    x = left + i
+                    old = self.get(x, y)
+                    self.set(x, y, tuple([o + int((c - o) * level) for o, c in zip(old, color)]))
+
     def draw_char(self, x, y, c, color, bg, aa=False, font_name=font.default_font, font_scale=1):
         """Draw a text character `c` with top-left corner placed at `(x,y)` in specified `color`
 
@@ -414,28 +744,27 @@ class Matrix(Pixels):
             c_data = FONT[c - f['bounds'][0]]
 
         fw = len(c_data)
-        for i in range(fw + f['sep']):
+        if bg is not None and bg != color:
+            self._fill_rect(x, y, (fw + f['sep']) * font_scale, fh * font_scale, bg)
+
+        for i in range(fw):
             xPos = x + (i * font_scale)
-            if ((xPos < self.width) and (xPos + fw * font_scale - 1) >= 0):
-                if i >= fw:
-                    line = 0
+            if xPos >= self.width or xPos + font_scale <= 0:
+                continue
+            # fill each vertical run of set bits as one span
+            line = c_data[i] & ((1 << fh) - 1)
+            j = 0
+            while line:
+                if line & 0x1:
+                    run = 0
+                    while line & 0x1:
+                        run += 1
+                        line >>= 1
+                    self._fill_rect(xPos, y + j * font_scale, font_scale, run * font_scale, color)
+                    j += run
                 else:
-                    line = FONT[c][i]
-                for j in range(fh):
-                    yPos = y + (j * font_scale)
-                    if ((yPos < self.height) and
-                            (yPos + fh * font_scale - 1) >= 0):
-                        if line & 0x1:
-                            if font_scale == 1:
-                                self.set(xPos, yPos, color)
-                            else:
-                                self.draw_rect_filled(xPos, yPos, font_scale, font_scale, color, aa)
-                        elif bg != color and bg is not None:
-                            if font_scale == 1:
-                                self.set(xPos, yPos, bg)
-                            else:
-                                self.draw_rect_filled(xPos, yPos, font_scale, font_scale, bg, aa)
                     line >>= 1
+                    j += 1
         return fw + f['sep']
 
     def draw_text(self, text, x=0, y=0,
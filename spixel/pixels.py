@@ -72,6 +72,40 @@ class Pixels(object):
 
         return (self.buffer[pixel * 3 + 0], self.buffer[pixel * 3 + 1], self.buffer[pixel * 3 + 2])
 
+    def rotate(self, n):
+        """Move all pixels `n` positions toward the end of the buffer in place,
+        wrapping around. Negative `n` moves them toward the start.
+
+        `n (int)`: Number of pixels to rotate by
+        """
+        n = (n % self.num) * 3 if self.num else 0
+        if n:
+            buf = self.buffer
+            tail = buf[-n:]
+            buf[n:] = buf[:-n]
+            buf[:n] = tail
+
+    def shift(self, n, fill=None):
+        """Move all pixels `n` positions toward the end of the buffer in place,
+        dropping those that fall off. Negative `n` moves them toward the start.
+
+        `n (int)`: Number of pixels to shift by
+
+        `fill (tuple)`: `(R,G,B)` color for the vacated pixels, off if omitted
+        """
+        k = min(abs(n), self.num)
+        if not k:
+            return
+        fill = list(fill or (0, 0, 0)) * k
+        buf = self.buffer
+        size = len(buf) - 3 * k
+        if n > 0:
+            buf[3 * k:] = buf[:size]
+            buf[:3 * k] = fill
+        else:
+            buf[:size] = buf[3 * k:]
+            buf[size:] = fill
+
     def __setitem__(self, pixel, color):
         self.set(pixel, color)
 
@@ -0,0 +1,226 @@
+"""
+Sprite sheets for drawing small pre-rendered images onto a `spixel.matrix.Matrix`.
+"""
+
+from collections import OrderedDict, namedtuple
+from . import log
+from . matrix import _image_source, _key_mask
+
+
+class TRANSFORM:
+    """Transforms that can be applied to a sprite when it is drawn"""
+    NONE = None
+    FLIP_X = 'flip_x'
+    FLIP_Y = 'flip_y'
+    ROTATE_90 = 'rotate_90'
+    ROTATE_180 = 'rotate_180'
+    ROTATE_270 = 'rotate_270'
+
+
+Sprite = namedtuple('Sprite', 'width height rows reversed_rows runs')
+Sprite.__doc__ = """A sprite converted for drawing, as cached by `SpriteSheet`.
+`rows` holds the `R,G,B` bytes of each row left to right and `reversed_rows`
+right to left, matching the two directions matrix rows can run in the buffer.
+`runs` lists the `(start, stop)` columns of the opaque pixels on each row."""
+
+
+def _reverse(row):
+    """`R,G,B` bytes with the pixel order reversed"""
+    out = bytearray(len(row))
+    for c in range(3):
+        out[c::3] = row[c::3][::-1]
+    return bytes(out)
+
+
+def _column(data, w, h, x):
+    """Column `x` of a `w` by `h` image as `R,G,B` bytes, top to bottom"""
+    out = bytearray(h * 3)
+    for c in range(3):
+        out[c::3] = data[x * 3 + c::w * 3]
+    return bytes(out)
+
+
+def _transform(data, w, h, transform):
+    """Returns `(rows, width, height)` of an image after `transform`"""
+    rows = [data[y * w * 3:(y + 1) * w * 3] for y in range(h)]
+    if transform is TRANSFORM.NONE:
+        return rows, w, h
+    if transform == TRANSFORM.FLIP_X:
+        return [_reverse(r) for r in rows], w, h
+    if transform == TRANSFORM.FLIP_Y:
+        return rows[::-1], w, h
+    if transform == TRANSFORM.ROTATE_180:
+        return [_reverse(r) for r in rows[::-1]], w, h
+    if transform == TRANSFORM.ROTATE_90:
+        # clockwise, the left column read bottom to top becomes the top row
+        return [_reverse(_column(data, w, h, x)) for x in range(w)], h, w
+    if transform == TRANSFORM.ROTATE_270:
+        return [_column(data, w, h, x) for x in range(w - 1, -1, -1)], h, w
+    raise ValueError('Unknown sprite transform: {}'.format(transform))
+
+
+def _tint(row, tint):
+    """Multiply each channel of `R,G,B` bytes by `tint` / 255"""
+    out = bytearray(len(row))
+    for c, t in enumerate(tint):
+        out[c::3] = row[c::3].translate(bytes([v * t // 255 for v in range(256)]))
+    return bytes(out)
+
+
+def _runs(mask):
+    """`(start, stop)` of each run of zero bytes in `mask`"""
+    runs = []
+    i = mask.find(0)
+    while i >= 0:
+        j = mask.find(1, i)
+        if j < 0:
+            j = len(mask)
+        runs.append((i, j))
+        i = mask.find(0, j)
+    return runs
+
+
+class SpriteSheet(object):
+    """Slices an image into equally sized sprites, numbered left to right
+    and top to bottom, and draws them onto a `spixel.matrix.Matrix`.
+
+    Each combination of sprite, transform and tint is converted once into
+    rows ready to be copied into the matrix buffer and kept in a least
+    recently used cache. Drawing a cached sprite is then one slice copy
+    per row, or per run of opaque pixels when `key_color` is set.
+
+    `src`: Sheet image in any format accepted by `spixel.matrix.Matrix.blit`
+
+    `sprite_width (int)`: Width of each sprite
+
+    `sprite_height (int)`: Height of each sprite
+
+    `w (int)`: Width of `src`, required for raw bytes
+
+    `names`: Optional list of names for the sprites, in sprite order
+
+    `key_color (tuple)`: `(R,G,B)` color treated as transparent
+
+    `cache_size (int)`: Maximum number of converted sprites to keep
+    """
+
+    def __init__(self, src, sprite_width, sprite_height, w=None, names=None,
+                 key_color=None, cache_size=64):
+        data, sheet_w, sheet_h = _image_source(src, w)
+        self.sprite_width = sprite_width
+        self.sprite_height = sprite_height
+        self.key_color = key_color
+        self.cache_size = cache_size
+
+        self.sprites = []
+        """Row-major `R,G,B` bytes of each sprite as sliced from the sheet"""
+        row_bytes = sprite_width * 3
+        for top in range(0, sheet_h - sprite_height + 1, sprite_height):
+            for left in range(0, sheet_w - sprite_width + 1, sprite_width):
+                start = (top * sheet_w + left) * 3
+                self.sprites.append(b''.join(
+                    [data[start + y * sheet_w * 3:start + y * sheet_w * 3 + row_bytes]
+                     for y in range(sprite_height)]))
+
+        self.names = {name: i for i, name in enumerate(names or [])}
+        """Dict of sprite name to index"""
+        self.hits = 0
+        """Number of draws served from the cache"""
+        self.misses = 0
+        """Number of sprites converted"""
+        self._cache = OrderedDict()
+
+    @classmethod
+    def load(cls, path, sprite_width, sprite_height, **kwds):
+        """Load a sprite sheet from an image file. Requires Pillow.
+
+        `**kwds`: keywords passed to `SpriteSheet`
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            error = "Unable to import PIL. Please install. pip install pillow"
+            log.error(error)
+            raise ImportError(error)
+
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            return cls(img.tobytes(), sprite_width, sprite_height, w=img.width, **kwds)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def index(self, sprite):
+        """Index of `sprite`, given as an index or a name"""
+        if isinstance(sprite, int):
+            return sprite
+        return self.names[sprite]
+
+    def get(self, sprite, transform=TRANSFORM.NONE, tint=None):
+        """Returns the `Sprite` for `sprite` after `transform` and `tint`, converting it if not cached.
+
+        `sprite`: Sprite index or name
+
+        `transform`: One of `TRANSFORM`
+
+        `tint (tuple)`: `(R,G,B)` color to multiply the sprite colors by, `None` for none
+        """
+        key = (self.index(sprite), transform, None if tint is None else tuple(tint))
+        entry = self._cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = self._convert(*key)
+        self._cache[key] = entry
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    def _convert(self, index, transform, tint):
+        rows, w, h = _transform(self.sprites[index], self.sprite_width, self.sprite_height, transform)
+        if self.key_color is None:
+            runs = [[(0, w)]] * h
+        else:
+            # transparency follows the untinted colors
+            runs = [_runs(_key_mask(row, self.key_color)) for row in rows]
+        if tint is not None:
+            rows = [_tint(row, tint) for row in rows]
+        return Sprite(w, h, rows, [_reverse(row) for row in rows], runs)
+
+    def clear_cache(self):
+        """Drop all converted sprites"""
+        self._cache.clear()
+
+    def draw(self, matrix, sprite, x=0, y=0, transform=TRANSFORM.NONE, tint=None):
+        """Draw `sprite` with its top-left corner at `(x,y)` on `matrix`, clipped to it.
+
+        `matrix`: `spixel.matrix.Matrix` to draw on
+
+        `sprite`, `transform`, `tint`: see `SpriteSheet.get`
+        """
+        s = self.get(sprite, transform, tint)
+        left, right = max(x, 0) - x, min(x + s.width, matrix.width) - x
+        if left >= right:
+            return
+
+        buf = matrix.buffer
+        offsets = matrix.offsets
+        for row in range(max(y, 0), min(y + s.height, matrix.height)):
+            sy = row - y
+            stride = matrix._row_strides[row]
+            index = row * matrix.width + x
+            for a, b in s.runs[sy]:
+                a, b = max(a, left), min(b, right)
+                if a >= b:
+                    continue
+                if stride == 3:
+                    first = offsets[index + a]
+                    buf[first:first + 3 * (b - a)] = s.rows[sy][a * 3:b * 3]
+                elif stride == -3:
+                    first = offsets[index + a]
+                    buf[first - 3 * (b - a - 1):first + 3] = s.reversed_rows[sy][(s.width - b) * 3:(s.width - a) * 3]
+                else:
+                    matrix._write_run(index + a, 1, b - a, stride, s.rows[sy][a * 3:b * 3])
@@ -0,0 +1,83 @@
+import sys
+import timeit
+import types
+from spixel.drivers.APA102 import APA102
+from spixel.drivers.transport import MemoryTransport, SpiDevTransport
+from spixel import Pixels
+from spixel import colors
+
+NUM = 1000
+FRAMES = 200
+
+
+class FakeSpiDev(object):
+    """Stands in for spidev.SpiDev. Copies every transfer the way py-spidev
+    fills its transfer buffer, so the write path is timed without hardware."""
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def writebytes(self, values):
+        # py-spidev converts the list element by element
+        bytes(values)
+
+
+class FakeSpiDev2(FakeSpiDev):
+    """py-spidev >= 3.3, which also has the buffer based writebytes2"""
+
+    def writebytes2(self, data):
+        memoryview(data).tobytes()
+
+
+class BenchSpiDevTransport(SpiDevTransport):
+    """`SpiDevTransport` on a fake spidev module, skips the device checks"""
+
+    def __init__(self, spidev_class):
+        sys.modules['spidev'] = types.SimpleNamespace(SpiDev=spidev_class)
+        super().__init__()
+
+    def _bootstrapSPIDev(self):
+        pass
+
+
+def legacy_update(d, data):
+    """Pre-bytearray list encoding, kept for comparison"""
+    buf = [0] * (d.num * 3)
+    packet = [0] * len(d._packet)
+    for a, b in enumerate(d.c_order):
+        buf[a:d.num * 3:3] = [d.gamma[v] for v in data[b::3]]
+    packet[d._start_frame + 1:d._pixel_stop:4] = buf[0::3]
+    packet[d._start_frame + 2:d._pixel_stop:4] = buf[1::3]
+    packet[d._start_frame + 3:d._pixel_stop:4] = buf[2::3]
+    # py-spidev converts lists element by element
+    d.transport.write(bytes(packet))
+
+
+def make_pixels(transport):
+    pixels = Pixels(APA102(transport=transport), NUM)
+    for i in range(NUM):
+        pixels[i] = colors.hue_rainbow[i % 256]
+    return pixels
+
+
+def bench(func):
+    return timeit.timeit(func, number=FRAMES) * 1000 / FRAMES
+
+
+# encoding only
+pixels = make_pixels(MemoryTransport())
+legacy = bench(lambda: legacy_update(pixels.driver, pixels.buffer))
+current = bench(pixels.update)
+
+# encoding and the spidev write paths
+writebytes2 = bench(make_pixels(BenchSpiDevTransport(FakeSpiDev2)).update)
+writebytes = bench(make_pixels(BenchSpiDevTransport(FakeSpiDev)).update)
+
+print('{} pixels, {} frames'.format(NUM, FRAMES))
+print('list encoding:         {:.3f}ms/frame'.format(legacy))
+print('bytearray encoding:    {:.3f}ms/frame'.format(current))
+print('spidev writebytes2:    {:.3f}ms/frame'.format(writebytes2))
+print('spidev writebytes:     {:.3f}ms/frame'.format(writebytes))
@@ -0,0 +1,41 @@
+import timeit
+from spixel.drivers.driver_base import DriverBase
+from spixel import Matrix
+from spixel import colors
+
+W = 64
+H = 64
+FRAMES = 50
+
+TRIANGLE = [(2, 3), (60, 20), (20, 61)]
+STAR = [(32, 2), (39, 24), (62, 24), (44, 38), (51, 61), (32, 47), (13, 61), (20, 38), (2, 24), (25, 24)]
+
+
+def inside(points, x, y):
+    """Even-odd point in polygon test"""
+    result = False
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            result = not result
+    return result
+
+
+def naive_fill(m, points, color):
+    """Per-pixel fill, kept for comparison"""
+    for y in range(m.height):
+        for x in range(m.width):
+            if inside(points, x, y):
+                m.set(x, y, color)
+
+
+m = Matrix(DriverBase(), W, H)
+
+print('{}x{} matrix, {} frames'.format(W, H, FRAMES))
+for name, points in (('triangle', TRIANGLE), ('star', STAR)):
+    naive = timeit.timeit(lambda: naive_fill(m, points, colors.Red), number=FRAMES)
+    scan = timeit.timeit(lambda: m.draw_polygon_filled(points, colors.Red), number=FRAMES)
+    aa = timeit.timeit(lambda: m.draw_polygon_filled(points, colors.Red, aa=True), number=FRAMES)
+    print('{}:'.format(name))
+    print('  per-pixel:        {:.3f}ms/frame'.format(naive * 1000 / FRAMES))
+    print('  scanline:         {:.3f}ms/frame'.format(scan * 1000 / FRAMES))
+    print('  scanline aa:      {:.3f}ms/frame'.format(aa * 1000 / FRAMES))
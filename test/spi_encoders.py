@@ -0,0 +1,55 @@
+import sys
+from spixel.drivers.APA102 import APA102
+from spixel.drivers.LPD8806 import LPD8806
+from spixel.drivers.P9813 import P9813
+from spixel.drivers.WS2801 import WS2801
+from spixel.drivers.transport import MemoryTransport
+from spixel import Pixels
+
+# Known-good frames for two pixels, worked out by hand from the datasheets.
+# Run without SPI hardware to regression test the encoders.
+PIXELS = [(0x12, 0xC4, 0xFE), (0xFF, 0x00, 0x81)]
+
+failed = False
+
+
+def check(name, driver, expected, setup=None):
+    global failed
+    pixels = Pixels(driver, len(PIXELS))
+    if setup:
+        setup(driver)
+    for i, color in enumerate(PIXELS):
+        pixels[i] = color
+    pixels.update()
+    frame = driver.transport.last
+    ok = frame == bytes.fromhex(expected)
+    failed = failed or not ok
+    print('{:24} {}'.format(name, 'ok' if ok else 'FAIL ' + frame.hex(' ')))
+
+
+def linear(driver):
+    driver.gamma = list(range(256))
+    driver.compile()
+
+
+# raw R,G,B
+check('WS2801', WS2801(transport=MemoryTransport()),
+      '12 c4 fe  ff 00 81')
+
+# G,R,B as 0x80 | value >> 1, one zero latch byte per 32 pixels
+check('LPD8806', LPD8806(transport=MemoryTransport()),
+      'e2 89 ff  80 ff c0  00')
+
+# 4 zero bytes, [0b11 ~B7:6 ~G7:6 ~R7:6, B, G, R] per pixel, 4 zero bytes
+check('P9813', P9813(transport=MemoryTransport()),
+      '00 00 00 00  c3 fe c4 12  dc 81 00 ff  00 00 00 00')
+
+# 4 zero bytes, [0xE0 | 5 bit brightness, B, G, R] per pixel, 4 + num / 2 + 1 zero bytes
+check('APA102', APA102(transport=MemoryTransport()),
+      '00 00 00 00  ff fe c4 12  ff 81 00 ff  00 00 00 00 00 00',
+      setup=linear)
+check('APA102 brightness 64', APA102(transport=MemoryTransport()),
+      '00 00 00 00  e8 fe c4 12  e8 81 00 ff  00 00 00 00 00 00',
+      setup=lambda d: (linear(d), d.set_master_brightness(64)))
+
+sys.exit(1 if failed else 0)